@@ -5,11 +5,22 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
+from sqlalchemy import event
+from sqlalchemy.orm import validates, selectinload, Session as OrmSession
+from datetime import datetime, timedelta, timezone
 import os
 import base64
+import hashlib
 import json
+import threading
+import time
+import math
+import heapq
+from collections import OrderedDict
 from openpyxl import Workbook
+from PIL import Image
+from tokenizer import TOKENIZER_VERSION, segment_text, token_set
+from image_hash import ImageHashIndex, dhash, hash_from_hex, hash_to_hex
 from io import BytesIO
 
 app = Flask(__name__)
@@ -30,6 +41,26 @@ app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=7)
 app.config['JWT_TOKEN_LOCATION'] = ['headers', 'query_string']
 app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'uploads')
 app.config['MAX_CONTENT_LENGTH'] = 12 * 1024 * 1024
+# 公开物品列表响应缓存（进程内 LRU + TTL）
+app.config['ITEMS_CACHE_MAXSIZE'] = int(os.getenv('ITEMS_CACHE_MAXSIZE', '256'))
+app.config['ITEMS_CACHE_TTL'] = int(os.getenv('ITEMS_CACHE_TTL', '30'))  # 秒
+# 敏感词回扫任务：每批读取行数、心跳超时
+app.config['MODERATION_SCAN_CHUNK_SIZE'] = int(os.getenv('MODERATION_SCAN_CHUNK_SIZE', '500'))
+app.config['MODERATION_SCAN_STALE_SECONDS'] = int(os.getenv('MODERATION_SCAN_STALE_SECONDS', '300'))
+# 匹配推荐：每个物品保存的匹配条数（发布/修改后在后台计算）
+app.config['MATCH_TOP_N'] = int(os.getenv('MATCH_TOP_N', '5'))
+# 每个用户最多保存的订阅搜索条数
+app.config['SAVED_SEARCH_LIMIT'] = int(os.getenv('SAVED_SEARCH_LIMIT', '20'))
+# 未读计数校正间隔（秒，0 表示不启动定时校正，仍可通过管理接口手动触发）
+app.config['UNREAD_COUNTER_RECONCILE_INTERVAL'] = int(os.getenv('UNREAD_COUNTER_RECONCILE_INTERVAL', '3600'))
+# 通知归档：已读且早于保留天数的通知移入归档表（0 表示不归档）、每批行数、定时归档间隔（秒）
+app.config['NOTIFICATION_RETENTION_DAYS'] = int(os.getenv('NOTIFICATION_RETENTION_DAYS', '90'))
+app.config['NOTIFICATION_ARCHIVE_BATCH_SIZE'] = int(os.getenv('NOTIFICATION_ARCHIVE_BATCH_SIZE', '500'))
+app.config['NOTIFICATION_ARCHIVE_INTERVAL'] = int(os.getenv('NOTIFICATION_ARCHIVE_INTERVAL', '86400'))
+# 通知合并窗口（秒）：同一来源的未读通知自创建起窗口内重复出现时合并为一行（0 表示不合并）
+app.config['NOTIFICATION_COALESCE_WINDOW'] = int(os.getenv('NOTIFICATION_COALESCE_WINDOW', '600'))
+# 图片相似：dHash 汉明距离不超过该值视为外观相似（64 位中）
+app.config['IMAGE_MATCH_MAX_DISTANCE'] = int(os.getenv('IMAGE_MATCH_MAX_DISTANCE', '10'))
 
 # 创建上传文件夹
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -43,7 +74,8 @@ ROLE_SUPER_ADMIN = 'super_admin'
 ADMIN_APPLICATION_STATUSES = ('pending', 'approved', 'rejected', 'revoked')
 ADMIN_REAPPLY_COOLDOWN = timedelta(hours=24)
 
-# 敏感词列表（中英文）- 以多字词/短语为主，避免单字误伤（如曹操、日本、生日、干活、打球等）
+# 默认敏感词列表（中英文）- 以多字词/短语为主，避免单字误伤（如曹操、日本、生日、干活、打球等）
+# 运行时词库保存在 sensitive_term 表中，此列表仅在首次启动时写入；之后通过管理接口增删
 SENSITIVE_WORDS = [
     # 中文敏感词（短语优先，不含易误伤单字如操/日/干/打/死/杀/骗/偷/抢/盗/性/淫/骚/贱）
     '傻逼', '傻B', 'SB', '草泥马', '操你妈', '操他妈', '你妈', '他妈的', '妈的', '卧槽', '我靠',
@@ -62,7 +94,7 @@ SENSITIVE_WORDS = [
     'spam', 'scam', 'fraud', 'cheat', 'steal', 'rob'
 ]
 
-# 安全词白名单：包含敏感字但为正常用语的词/短语，检测前会先替换为占位符，避免误伤
+# 默认安全词白名单：包含敏感字但为正常用语的词/短语，检测前会先替换为占位符，避免误伤
 # 按长度从长到短排序，先替换长短语再替换短词（如先“曹操”再“操”所在的其他安全词）
 SAFE_PHRASES = [
     # 含“操”
@@ -91,8 +123,6 @@ SAFE_PHRASES = [
     '贱卖', '贱价', '贵贱', '贫贱',
     # 英文：ass 在 class、pass、glass 等中误伤，用整词匹配时已避免；kill 在 skill 等，用整词
 ]
-# 按长度降序，优先替换更长短语
-SAFE_PHRASES_SORTED = sorted(SAFE_PHRASES, key=len, reverse=True)
 
 # 占位符：用于替换安全词，避免被敏感词匹配（使用零宽字符，不改变长度）
 def _placeholder(length):
@@ -107,23 +137,145 @@ def _is_word_boundary(text, start, length):
         return False
     return True
 
-def contains_sensitive_words(text):
-    """检查文本是否包含敏感词（先屏蔽安全词白名单，再检测，减少误伤如曹操、操作、日本等）"""
-    if not text:
-        return False, []
+class SensitiveWordMatcher:
+    """敏感词 + 安全词白名单的 Aho-Corasick 多模式匹配器。
+
+    构建一次后可在多个线程中复用（只读）。检测结果与逐词 replace/find 的实现一致：
+    安全词按长度从长到短依次屏蔽（同一短语取最左不重叠的出现），
+    敏感词在屏蔽后的小写文本上匹配，英文敏感词要求整词匹配。
+    """
+
+    def __init__(self, sensitive_words, safe_phrases):
+        self.sensitive_words = list(sensitive_words)
+        # 安全词优先级：长度降序（先屏蔽更长短语），同长度保持原顺序
+        self.safe_phrases = list(dict.fromkeys(sorted(safe_phrases, key=len, reverse=True)))
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        # 模式以小写形式进入自动机；每个模式记录 (kind, index)
+        pattern_ids = {}
+        self._patterns = []
+        for kind, terms in (('safe', self.safe_phrases), ('word', self.sensitive_words)):
+            for index, term in enumerate(terms):
+                if not term:
+                    continue
+                key = term.lower()
+                if key not in pattern_ids:
+                    pattern_ids[key] = len(self._patterns)
+                    self._patterns.append((key, []))
+                    self._add_pattern(key, pattern_ids[key])
+                self._patterns[pattern_ids[key]][1].append((kind, index))
+        self._build_fail_links()
+
+    def _add_pattern(self, pattern, pattern_id):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[node][ch] = nxt
+            node = nxt
+        self._out[node].append(pattern_id)
+
+    def _build_fail_links(self):
+        queue = list(self._goto[0].values())
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def _scan(self, text):
+        """单次扫描，返回 [(start, end, pattern_id)]"""
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self._patterns
+        hits = []
+        node = 0
+        for i, ch in enumerate(text):
+            nxt = goto[node].get(ch)
+            while nxt is None and node:
+                node = fail[node]
+                nxt = goto[node].get(ch)
+            node = nxt or 0
+            if out[node]:
+                for pattern_id in out[node]:
+                    hits.append((i + 1 - len(patterns[pattern_id][0]), i + 1, pattern_id))
+        return hits
+
+    def find(self, text):
+        """返回 (是否包含敏感词, 命中的敏感词列表)，列表顺序与 sensitive_words 一致"""
+        if not text:
+            return False, []
+        lower = text.lower()
+        if len(lower) != len(text):
+            # 个别字符小写后长度改变（如 'İ'），位置无法对齐，回退到逐词检测
+            return _contains_sensitive_words_naive(text, self.sensitive_words, self.safe_phrases)
+
+        safe_hits = []
+        word_hits = []
+        for start, end, pattern_id in self._scan(lower):
+            for kind, index in self._patterns[pattern_id][1]:
+                if kind == 'safe':
+                    # 安全词按原文大小写精确匹配
+                    if text[start:end] == self.safe_phrases[index]:
+                        safe_hits.append((index, start, end))
+                else:
+                    word_hits.append((index, start, end))
+        if not word_hits:
+            return False, []
+
+        # 依优先级屏蔽安全词：与已屏蔽区间或同一短语上一次屏蔽重叠的出现被跳过
+        masked = bytearray(len(text))
+        safe_hits.sort()
+        last_index, last_end = None, 0
+        for index, start, end in safe_hits:
+            if index != last_index:
+                last_index, last_end = index, 0
+            if start < last_end or any(masked[start:end]):
+                continue
+            masked[start:end] = b'\x01' * (end - start)
+            last_end = end
+
+        def is_word_char(pos):
+            if pos < 0 or pos >= len(text) or masked[pos]:
+                return False
+            return text[pos].isalnum() or text[pos] == '_'
+
+        found = set()
+        for index, start, end in word_hits:
+            if index in found or any(masked[start:end]):
+                continue
+            # 英文敏感词要求整词匹配，避免误伤 skill(kill)、class(ass)、password(ass) 等
+            if self.sensitive_words[index].isascii() and (is_word_char(start - 1) or is_word_char(end)):
+                continue
+            found.add(index)
+        found_words = [word for index, word in enumerate(self.sensitive_words) if index in found]
+        return len(found_words) > 0, found_words
+
+
+def _contains_sensitive_words_naive(text, sensitive_words, safe_phrases_sorted):
+    """逐词 replace/find 的原始实现，仅在无法按位置对齐时使用"""
     # 先对原文做安全词替换（仅用于检测的副本）
     check_text = text
-    for phrase in SAFE_PHRASES_SORTED:
+    for phrase in safe_phrases_sorted:
         if phrase in check_text:
             check_text = check_text.replace(phrase, _placeholder(len(phrase)))
     # 再对替换后的文本做敏感词检测
     check_lower = check_text.lower()
     found_words = []
-    for word in SENSITIVE_WORDS:
+    for word in sensitive_words:
         w_lower = word.lower()
         if w_lower not in check_lower:
             continue
-        # 英文敏感词要求整词匹配，避免误伤 skill(kill)、class(ass)、password(ass) 等
         if word.isascii():
             idx = 0
             while True:
@@ -138,6 +290,42 @@ def contains_sensitive_words(text):
             found_words.append(word)
     return len(found_words) > 0, found_words
 
+
+# 每个进程缓存一份已编译的匹配器，词库版本（cache_generation 中的代数）变化时惰性重建。
+# 版本 0 表示词库从未写入（如初始化失败），此时沿用代码中的默认词表，不会编译出空匹配器
+SENSITIVE_WORDS_GENERATION = 'sensitive_words'
+# 默认词表是否已写入 sensitive_term；只写一次，管理员删光词条后不会在重启时恢复
+SENSITIVE_TERMS_SEEDED = 'sensitive_terms_seeded'
+_sensitive_matcher_cache = {'version': 0, 'matcher': SensitiveWordMatcher(SENSITIVE_WORDS, SAFE_PHRASES)}
+_sensitive_matcher_lock = threading.Lock()
+
+def get_sensitive_word_matcher():
+    """返回与当前词库版本一致的匹配器（每次只查询一次版本号，不重复编译）"""
+    try:
+        version = get_generation(SENSITIVE_WORDS_GENERATION)
+    except Exception as e:
+        # 词库表不可用（如迁移前）时继续使用已编译的匹配器
+        print(f'[WARNING] 读取敏感词库版本失败，使用已缓存词库: {e}')
+        return _sensitive_matcher_cache['matcher']
+    if _sensitive_matcher_cache['version'] == version:
+        return _sensitive_matcher_cache['matcher']
+    with _sensitive_matcher_lock:
+        if _sensitive_matcher_cache['version'] != version:
+            terms = SensitiveTerm.query.order_by(SensitiveTerm.id.asc()).all()
+            matcher = SensitiveWordMatcher(
+                [t.term for t in terms if t.kind == SENSITIVE_TERM_WORD],
+                [t.term for t in terms if t.kind == SENSITIVE_TERM_SAFE]
+            )
+            _sensitive_matcher_cache.update(version=version, matcher=matcher)
+            print(f'✅ 敏感词库已重新编译：版本 {version}，{len(matcher.sensitive_words)} 个敏感词，{len(matcher.safe_phrases)} 个安全词')
+        return _sensitive_matcher_cache['matcher']
+
+def contains_sensitive_words(text):
+    """检查文本是否包含敏感词（先屏蔽安全词白名单，再检测，减少误伤如曹操、操作、日本等）"""
+    if not text:
+        return False, []
+    return get_sensitive_word_matcher().find(text)
+
 # 添加错误处理器来捕获 415 错误和其他错误
 @app.errorhandler(415)
 def unsupported_media_type(error):
@@ -262,27 +450,34 @@ class Item(db.Model):
     contact_name = db.Column(db.String(50), nullable=False)
     contact_phone = db.Column(db.String(20), nullable=False)
     date = db.Column(db.String(20), nullable=False)
-    image_path = db.Column(db.String(200))  # 主图（向后兼容）
-    images_path = db.Column(db.Text)  # 多张图片路径（JSON格式）
+    date_value = db.Column(db.Date, index=True)  # date 的规范化日期，用于范围筛选
+    # 旧版图片字段，启动时迁移到 item_image 表后清空，不再写入
+    image_path = db.Column(db.String(200))
+    images_path = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)  # 物品版本，用于 ETag / Last-Modified
     status = db.Column(db.String(20), default='open')
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
 
+    # 游标分页按 (created_at, id) 倒序扫描
+    __table_args__ = (
+        db.Index('ix_item_created_at_id', 'created_at', 'id'),
+        db.Index('ix_item_status_created_at_id', 'status', 'created_at', 'id'),
+        db.Index('ix_item_user_created_at_id', 'user_id', 'created_at', 'id'),
+        db.Index('ix_item_updated_at', 'updated_at'),  # 匹配引擎按更新时间增量同步
+    )
+
+    # 图片按 position 排序，第一张为主图
+    images = db.relationship('ItemImage', order_by='ItemImage.position', cascade='all, delete-orphan')
+
+    @validates('date')
+    def _sync_date_value(self, key, value):
+        # 任何写入 date 的路径都同步维护 date_value
+        self.date_value = parse_item_date(value)
+        return value
+
     def to_dict(self):
-        # 处理多张图片
-        image_urls = []
-        if self.images_path:
-            try:
-                image_paths = json.loads(self.images_path)
-                if isinstance(image_paths, list):
-                    image_urls = [f'/api/image/{path}' for path in image_paths if path]
-            except:
-                pass
-        
-        # 向后兼容：如果没有多张图片但有主图，使用主图
-        if not image_urls and self.image_path:
-            image_urls = [f'/api/image/{self.image_path}']
-        
+        image_urls = [image.url for image in self.images]
         return {
             'id': self.id,
             'title': self.title,
@@ -295,6 +490,7 @@ class Item(db.Model):
             'date': self.date,
             'image_url': image_urls[0] if image_urls else None,  # 主图（向后兼容）
             'image_urls': image_urls,  # 所有图片列表
+            'images': [image.to_dict() for image in self.images],  # 含尺寸信息，便于前端占位布局
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
             'status': self.status,
             'user_id': self.user_id,
@@ -302,6 +498,36 @@ class Item(db.Model):
         }
 
 
+class ItemImage(db.Model):
+    """物品图片表（取代 Item.image_path / images_path）"""
+    __tablename__ = 'item_image'
+    id = db.Column(db.Integer, primary_key=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False, default=0)
+    path = db.Column(db.String(200), nullable=False)
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    bytes = db.Column(db.Integer)
+    dhash = db.Column(db.String(16))  # 64 位感知哈希（十六进制）；'' 表示无法解析
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_item_image_item_position', 'item_id', 'position'),
+    )
+
+    @property
+    def url(self):
+        return f'/api/image/{self.path}'
+
+    def to_dict(self):
+        return {
+            'url': self.url,
+            'width': self.width,
+            'height': self.height,
+            'bytes': self.bytes
+        }
+
+
 class Notification(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -311,6 +537,16 @@ class Notification(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     related_item_id = db.Column(db.Integer, db.ForeignKey('item.id'))
+    # 合并通知：coalesce_key 标识来源（如某个会话），count 为合并的次数，last_time 为最近一次发生时间
+    coalesce_key = db.Column(db.String(100))
+    count = db.Column(db.Integer, default=1)
+    last_time = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_notification_user_read', 'user_id', 'is_read'),
+        db.Index('ix_notification_user_created', 'user_id', 'created_at'),
+        db.Index('ix_notification_coalesce', 'user_id', 'coalesce_key', 'is_read'),
+    )
 
     def to_dict(self):
         return {
@@ -320,7 +556,45 @@ class Notification(db.Model):
             'type': self.type,
             'is_read': self.is_read,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'related_item_id': self.related_item_id
+            'related_item_id': self.related_item_id,
+            'count': self.count or 1,
+            'last_time': (self.last_time or self.created_at).strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+class NotificationArchive(db.Model):
+    """已归档通知：保留期外的已读通知从 notification 表移入此表。
+    notification 表的 id 在末尾行被移走后可能被复用，因此归档使用自己的主键，原 id 记在 notification_id"""
+    __tablename__ = 'notification_archive'
+    id = db.Column(db.Integer, primary_key=True)
+    notification_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    title = db.Column(db.String(100), nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    type = db.Column(db.String(20), default='info')
+    is_read = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime)
+    related_item_id = db.Column(db.Integer, db.ForeignKey('item.id'))
+    count = db.Column(db.Integer, default=1)
+    last_time = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_notification_archive_user_created', 'user_id', 'created_at'),
+        db.Index('ix_notification_archive_item', 'related_item_id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'title': self.title,
+            'content': self.content,
+            'type': self.type,
+            'is_read': self.is_read,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            'related_item_id': self.related_item_id,
+            'count': self.count or 1,
+            'last_time': (self.last_time or self.created_at).strftime('%Y-%m-%d %H:%M:%S'),
+            'archived_at': self.archived_at.strftime('%Y-%m-%d %H:%M:%S') if self.archived_at else None
         }
 
 class AdminApplication(db.Model):
@@ -386,6 +660,10 @@ class Message(db.Model):
     # 关联关系
     sender = db.relationship('User', foreign_keys=[sender_id], backref='sent_messages')
     receiver = db.relationship('User', foreign_keys=[receiver_id], backref='received_messages')
+
+    __table_args__ = (
+        db.Index('ix_message_receiver_read', 'receiver_id', 'is_read'),
+    )
     
     def to_dict(self, current_user_id):
         """转换为字典"""
@@ -486,7 +764,10 @@ class Favorite(db.Model):
     item = db.relationship('Item', backref='favorited_by')
     
     # 唯一约束：一个用户只能收藏一个物品一次
-    __table_args__ = (db.UniqueConstraint('user_id', 'item_id', name='unique_user_item_favorite'),)
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'item_id', name='unique_user_item_favorite'),
+        db.Index('ix_favorite_user_created_at_id', 'user_id', 'created_at', 'id'),
+    )
     
     def to_dict(self):
         return {
@@ -514,24 +795,39 @@ class Comment(db.Model):
     reply_to_user = db.relationship('User', foreign_keys=[reply_to_user_id], backref='replied_comments')
     parent = db.relationship('Comment', remote_side=[id], backref='replies')
     
-    def to_dict(self, current_user_id=None):
+    def to_dict(self, current_user_id=None, children=None, liked_ids=None, levels=None):
+        """批量序列化时可传入预先计算好的数据，避免逐条查询：
+        children: {parent_id: [未删除的子评论]}，由整棵评论树一次查询得到；
+        liked_ids: 当前用户点赞过的评论 id 集合；
+        levels: {评论 id: 回复层级}。
+        不传时按原方式逐条查询。"""
+        if children is None:
+            replies = [reply for reply in self.replies if not reply.is_deleted] if self.replies else []
+        else:
+            replies = children.get(self.id, [])
+
         # 检查当前用户是否已点赞
         is_liked = False
-        if current_user_id:
+        if liked_ids is not None:
+            is_liked = self.id in liked_ids
+        elif current_user_id:
             is_liked = CommentLike.query.filter_by(
                 comment_id=self.id,
                 user_id=current_user_id
             ).first() is not None
         
         # 判断是几级回复
-        level = 0  # 0表示顶级评论
-        if self.parent_id:
-            parent_comment = Comment.query.get(self.parent_id)
-            if parent_comment:
-                if parent_comment.parent_id:
-                    level = 2  # 二级回复（回复的回复）
-                else:
-                    level = 1  # 一级回复（回复顶级评论）
+        if levels is not None and self.id in levels:
+            level = levels[self.id]
+        else:
+            level = 0  # 0表示顶级评论
+            if self.parent_id:
+                parent_comment = Comment.query.get(self.parent_id)
+                if parent_comment:
+                    if parent_comment.parent_id:
+                        level = 2  # 二级回复（回复的回复）
+                    else:
+                        level = 1  # 一级回复（回复顶级评论）
         
         return {
             'id': self.id,
@@ -548,8 +844,8 @@ class Comment(db.Model):
             'is_liked': is_liked,
             'level': level,  # 回复层级：1=一级回复，2=二级回复
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'replies': [reply.to_dict(current_user_id) for reply in self.replies if not reply.is_deleted] if self.replies else [],
-            'replies_count': len([r for r in self.replies if not r.is_deleted]) if self.replies else 0
+            'replies': [reply.to_dict(current_user_id, children, liked_ids, levels) for reply in replies],
+            'replies_count': len(replies)
         }
 
 class CommentLike(db.Model):
@@ -609,6 +905,1199 @@ class Claim(db.Model):
             'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S') if self.updated_at else None
         }
 
+class CacheGeneration(db.Model):
+    """缓存代数表：写操作在同一事务内递增代数，各进程读取代数判断缓存是否失效"""
+    __tablename__ = 'cache_generation'
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+SENSITIVE_TERM_WORD = 'word'
+SENSITIVE_TERM_SAFE = 'safe'
+
+class SensitiveTerm(db.Model):
+    """敏感词词库（kind: word=敏感词，safe=安全词白名单）"""
+    __tablename__ = 'sensitive_term'
+    id = db.Column(db.Integer, primary_key=True)
+    term = db.Column(db.String(100), nullable=False)
+    kind = db.Column(db.String(10), nullable=False, default=SENSITIVE_TERM_WORD)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'term', name='uq_sensitive_term_kind_term'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'term': self.term,
+            'kind': self.kind,
+            'created_by': self.created_by,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None
+        }
+
+class ModerationScan(db.Model):
+    """敏感词回扫任务，checkpoint 记录已处理到的 (表, 最大 id)，用于断点续扫"""
+    __tablename__ = 'moderation_scan'
+    id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending/running/completed/failed/cancelled
+    terms = db.Column(db.Text)  # 本次回扫的敏感词（JSON），为空表示使用完整词库
+    dictionary_version = db.Column(db.Integer)
+    source = db.Column(db.String(20))  # 断点：当前表
+    last_id = db.Column(db.Integer, default=0)  # 断点：当前表已处理的最大 id
+    total = db.Column(db.Integer, default=0)
+    scanned = db.Column(db.Integer, default=0)
+    flagged = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)  # 心跳
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status,
+            'terms': json.loads(self.terms) if self.terms else None,
+            'dictionary_version': self.dictionary_version,
+            'checkpoint': {'source': self.source, 'last_id': self.last_id or 0},
+            'total': self.total or 0,
+            'scanned': self.scanned or 0,
+            'flagged': self.flagged or 0,
+            'progress': round(min((self.scanned or 0) / self.total, 1.0) * 100, 1) if self.total else (100.0 if self.status == 'completed' else 0.0),
+            'error': self.error,
+            'created_by': self.created_by,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None,
+            'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S') if self.updated_at else None,
+            'finished_at': self.finished_at.strftime('%Y-%m-%d %H:%M:%S') if self.finished_at else None
+        }
+
+class ModerationFlag(db.Model):
+    """审核队列：回扫命中的历史内容"""
+    __tablename__ = 'moderation_flag'
+    id = db.Column(db.Integer, primary_key=True)
+    scan_id = db.Column(db.Integer, db.ForeignKey('moderation_scan.id'))
+    source_type = db.Column(db.String(20), nullable=False)  # item/comment/claim/message
+    source_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))  # 内容作者
+    matched_words = db.Column(db.Text, nullable=False)  # JSON 数组
+    excerpt = db.Column(db.String(200))
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending/resolved/dismissed
+    reviewed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    reviewed_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # 同一任务重复处理同一行（断点续扫）时不会重复入队
+        db.UniqueConstraint('scan_id', 'source_type', 'source_id', name='uq_moderation_flag_scan_source'),
+        db.Index('ix_moderation_flag_status_created_at_id', 'status', 'created_at', 'id'),
+    )
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'scan_id': self.scan_id,
+            'source_type': self.source_type,
+            'source_id': self.source_id,
+            'user_id': self.user_id,
+            'matched_words': json.loads(self.matched_words) if self.matched_words else [],
+            'excerpt': self.excerpt,
+            'status': self.status,
+            'reviewed_by': self.reviewed_by,
+            'reviewed_at': self.reviewed_at.strftime('%Y-%m-%d %H:%M:%S') if self.reviewed_at else None,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None
+        }
+
+class ItemToken(db.Model):
+    """物品匹配倒排索引：每行表示物品某字段含某词元；category/status 冗余存储，由触发器与 item 同步"""
+    __tablename__ = 'item_token'
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    field = db.Column(db.String(10), primary_key=True)  # type/location/text
+    token = db.Column(db.String(50), primary_key=True)
+    category = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20))
+
+    __table_args__ = (
+        db.Index('ix_item_token_lookup', 'category', 'status', 'field', 'token', 'item_id'),
+    )
+
+class ItemMatch(db.Model):
+    """物品匹配结果：发布/修改物品后由后台任务计算，双向各存一行，/matches 直接按分数读取"""
+    __tablename__ = 'item_match'
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    matched_item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    __table_args__ = (
+        db.Index('ix_item_match_item_score', 'item_id', 'score'),
+        db.Index('ix_item_match_matched', 'matched_item_id'),
+    )
+
+class ItemMatchState(db.Model):
+    """物品匹配的计算时间：有此行说明 item_match 已是后台任务的结果（即使为空），/matches 不再实时计算"""
+    __tablename__ = 'item_match_state'
+    item_id = db.Column(db.Integer, db.ForeignKey('item.id'), primary_key=True)
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+class SavedSearch(db.Model):
+    """订阅搜索：用户保存的 search/category/item_type 条件，有新物品命中时通知"""
+    __tablename__ = 'saved_search'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    name = db.Column(db.String(100))
+    search = db.Column(db.String(200), default='')
+    category = db.Column(db.String(50))
+    item_type = db.Column(db.String(50))
+    term_count = db.Column(db.Integer, nullable=False, default=0)
+    last_notified_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'search': self.search or '',
+            'category': self.category or '',
+            'item_type': self.item_type or '',
+            'last_notified_at': self.last_notified_at.strftime('%Y-%m-%d %H:%M:%S') if self.last_notified_at else None,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S') if self.created_at else None
+        }
+
+class SavedSearchTerm(db.Model):
+    """订阅搜索的倒排索引：每行表示订阅必须命中的一个词元（全部命中才算匹配）"""
+    __tablename__ = 'saved_search_term'
+    saved_search_id = db.Column(db.Integer, db.ForeignKey('saved_search.id'), primary_key=True)
+    token = db.Column(db.String(60), primary_key=True)
+
+    __table_args__ = (
+        db.Index('ix_saved_search_term_token', 'token', 'saved_search_id'),
+    )
+
+class UserCounter(db.Model):
+    """用户未读计数（冗余存储）：随通知/消息的写入和已读在同一事务内增减，定时任务校正偏差"""
+    __tablename__ = 'user_counter'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    unread_notifications = db.Column(db.Integer, nullable=False, default=0)
+    unread_messages = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+class ItemFacetCount(db.Model):
+    """物品分面计数（category × item_type × status），由 item 表上的触发器维护"""
+    __tablename__ = 'item_facet_count'
+    category = db.Column(db.String(50), primary_key=True)
+    item_type = db.Column(db.String(50), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+# 列表接口的批量预加载选项：to_dict 会访问发布者/认领人等关联对象，
+# 统一用 selectin 一次性 IN 查询加载，避免每行懒加载产生 N+1 查询
+# （backref 在映射配置完成后才存在，因此用函数延迟构造）
+def item_list_options():
+    return (selectinload(Item.user), selectinload(Item.images))
+
+def favorite_list_options():
+    return (selectinload(Favorite.item).options(*item_list_options()),)
+
+def claim_list_options():
+    return (
+        selectinload(Claim.claimant),
+        selectinload(Claim.item).options(*item_list_options()),
+    )
+
+def read_image_meta(filename):
+    """读取上传目录中图片的 (width, height, bytes, dhash)；失败的字段为 None，无法解码时 dhash 为 ''"""
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    width = height = size = None
+    image_hash = ''
+    try:
+        size = os.path.getsize(filepath)
+        with Image.open(filepath) as img:
+            width, height = img.size
+            image_hash = hash_to_hex(dhash(img))
+    except Exception as e:
+        print(f'[DEBUG] 读取图片信息失败: {filename}, 错误: {e}')
+    return width, height, size, image_hash
+
+def build_item_images(paths):
+    images = []
+    for position, path in enumerate(p for p in paths if p):
+        width, height, size, image_hash = read_image_meta(path)
+        images.append(ItemImage(position=position, path=path, width=width, height=height, bytes=size, dhash=image_hash))
+    return images
+
+def set_item_images(item, paths):
+    """按顺序替换物品图片；图片不在 item 行上，需手动推进 updated_at 使 ETag 失效"""
+    item.images = build_item_images(paths)
+    item.updated_at = datetime.now()
+
+def remove_upload_files(paths):
+    for path in paths:
+        try:
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], path)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        except Exception as e:
+            print(f'[DEBUG] 删除旧图片失败: {path}, 错误: {e}')
+
+ITEM_DATE_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y.%m.%d', '%Y-%m-%d %H:%M:%S', '%Y年%m月%d日')
+
+def parse_item_date(value):
+    """把物品的字符串日期解析为 date，无法解析时返回 None"""
+    if not value:
+        return None
+    text = str(value).strip()
+    if 'T' in text:
+        text = text.split('T', 1)[0]
+    for fmt in ITEM_DATE_FORMATS:
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+# ==================== 全文搜索索引 ====================
+# item_fts 为 SQLite FTS5 影子索引（rowid 即 item.id），索引 title/description/location/item_type。
+# 中日韩文本先切成二元组（并保留每段末字），再交给 unicode61 分词器，
+# 这样连续二元组组成的短语查询即等价于子串匹配，两字词（如“手机”）也能命中。
+SEARCH_FTS_ENABLED = False
+# 建表、写入与 bm25 权重都按此列顺序生成，不会彼此错位
+SEARCH_FTS_COLUMNS = ('title', 'description', 'location', 'item_type')
+# bm25 列权重：标题 > 物品类型 > 描述 > 地点
+SEARCH_FTS_COLUMN_WEIGHTS = {'title': 10.0, 'item_type': 5.0, 'description': 3.0, 'location': 2.0}
+SEARCH_FTS_WEIGHTS = tuple(SEARCH_FTS_COLUMN_WEIGHTS[column] for column in SEARCH_FTS_COLUMNS)
+
+def build_search_match_query(search):
+    """把用户输入转换为 FTS5 MATCH 表达式：每个空格分隔的词为一个前缀短语，词之间为 AND"""
+    phrases = []
+    for term in (search or '').split():
+        tokens = segment_text(term)
+        if tokens:
+            phrases.append('"' + ' '.join(tokens) + '" *')
+    return ' AND '.join(phrases)
+
+def index_item_for_search(item):
+    """写入/覆盖物品的搜索索引（在调用方事务内执行，需已有 item.id）"""
+    if not SEARCH_FTS_ENABLED or item is None or item.id is None:
+        return
+    db.session.execute(db.text('DELETE FROM item_fts WHERE rowid = :id'), {'id': item.id})
+    db.session.execute(
+        db.text(
+            f'INSERT INTO item_fts (rowid, {", ".join(SEARCH_FTS_COLUMNS)}) '
+            f'VALUES (:id, {", ".join(":" + column for column in SEARCH_FTS_COLUMNS)})'
+        ),
+        {
+            'id': item.id,
+            **{column: ' '.join(segment_text(getattr(item, column))) for column in SEARCH_FTS_COLUMNS}
+        }
+    )
+
+def remove_item_from_search(item_id):
+    if not SEARCH_FTS_ENABLED or item_id is None:
+        return
+    db.session.execute(db.text('DELETE FROM item_fts WHERE rowid = :id'), {'id': item_id})
+
+def rebuild_item_search_index(batch_size=500):
+    """清空并按 id 分批重建全部物品的搜索索引，返回索引的物品数量"""
+    if not SEARCH_FTS_ENABLED:
+        return 0
+    db.session.execute(db.text('DELETE FROM item_fts'))
+    last_id = 0
+    total = 0
+    while True:
+        batch = Item.query.filter(Item.id > last_id).order_by(Item.id.asc()).limit(batch_size).all()
+        if not batch:
+            break
+        for item in batch:
+            index_item_for_search(item)
+        total += len(batch)
+        last_id = batch[-1].id
+        db.session.commit()
+    db.session.commit()
+    return total
+
+# ==================== 匹配推荐索引 ====================
+MATCH_FIELD_TYPE = 'type'
+MATCH_FIELD_LOCATION = 'location'
+MATCH_FIELD_TEXT = 'text'
+MATCH_TOKEN_MAX_LENGTH = 50
+MATCH_TOKENIZER_GENERATION = 'match_tokenizer'  # 记录建索引时的分词版本
+
+# 字段权重：同一词元出现在类型、地点、标题/描述中时的 TF-IDF 权重倍数
+MATCH_FIELD_WEIGHTS = {MATCH_FIELD_TYPE: 3.0, MATCH_FIELD_LOCATION: 2.0, MATCH_FIELD_TEXT: 1.0}
+# 增量同步时向前多取的秒数，覆盖“已写入 updated_at 但稍后才提交”的事务
+MATCH_INDEX_SYNC_SLACK = 60
+
+ITEM_TOKEN_TRIGGERS = {
+    'trg_item_token_sync': """
+        CREATE TRIGGER trg_item_token_sync AFTER UPDATE OF category, status ON item BEGIN
+            UPDATE item_token SET category = NEW.category, status = NEW.status WHERE item_id = NEW.id;
+        END
+    """,
+    'trg_item_token_delete': """
+        CREATE TRIGGER trg_item_token_delete AFTER DELETE ON item BEGIN
+            DELETE FROM item_token WHERE item_id = OLD.id;
+        END
+    """,
+}
+
+ITEM_MATCH_TRIGGERS = {
+    'trg_item_match_delete': """
+        CREATE TRIGGER trg_item_match_delete AFTER DELETE ON item BEGIN
+            DELETE FROM item_match WHERE item_id = OLD.id OR matched_item_id = OLD.id;
+        END
+    """,
+    'trg_item_match_state_delete': """
+        CREATE TRIGGER trg_item_match_state_delete AFTER DELETE ON item BEGIN
+            DELETE FROM item_match_state WHERE item_id = OLD.id;
+        END
+    """,
+}
+
+def item_match_tokens(item):
+    """返回 {字段: 词元集合}；写入索引时计算一次，之后读取同一版本直接命中 item_token_cache"""
+    cache_key = (item.id, item.updated_at)
+    tokens = item_token_cache.get(cache_key) if item.id is not None else None
+    if tokens is None:
+        item_type = (item.item_type or '').strip().lower()
+        tokens = {
+            MATCH_FIELD_TYPE: frozenset([item_type]) if item_type else frozenset(),
+            MATCH_FIELD_LOCATION: token_set(item.location or '', MATCH_TOKEN_MAX_LENGTH),
+            MATCH_FIELD_TEXT: token_set(f'{item.title or ""} {item.description or ""}', MATCH_TOKEN_MAX_LENGTH),
+        }
+        if item.id is not None:
+            item_token_cache.set(cache_key, tokens)
+    return tokens
+
+def index_item_for_matching(item):
+    """写入/覆盖物品的匹配索引（在调用方事务内执行，需已有 item.id）"""
+    if item is None or item.id is None:
+        return
+    # 先 flush 使 updated_at 定版，词元集合按最终版本写入缓存
+    db.session.flush()
+    db.session.execute(db.text('DELETE FROM item_token WHERE item_id = :id'), {'id': item.id})
+    rows = [
+        {'item_id': item.id, 'field': field, 'token': token, 'category': item.category, 'status': item.status or 'open'}
+        for field, tokens in item_match_tokens(item).items()
+        for token in tokens
+    ]
+    if rows:
+        db.session.execute(
+            db.text(
+                'INSERT INTO item_token (item_id, field, token, category, status) '
+                'VALUES (:item_id, :field, :token, :category, :status)'
+            ),
+            rows
+        )
+
+def rebuild_item_match_index(batch_size=500):
+    """清空并按 id 分批重建全部物品的匹配索引，返回索引的物品数量"""
+    db.session.execute(db.text('DELETE FROM item_token'))
+    last_id = 0
+    total = 0
+    while True:
+        batch = Item.query.filter(Item.id > last_id).order_by(Item.id.asc()).limit(batch_size).all()
+        if not batch:
+            break
+        for item in batch:
+            index_item_for_matching(item)
+        total += len(batch)
+        last_id = batch[-1].id
+        db.session.commit()
+    db.session.commit()
+    return total
+
+class TfidfMatchIndex:
+    """按类别维护的稀疏 TF-IDF 矩阵（纯 Python：倒排表即矩阵的列存储）。
+
+    每个进行中物品是一行，特征为 (字段, 词元)，词频取 0/1，权重 = 字段权重 × idf。
+    查询时把查询物品的特征向量与相反类别的整个矩阵做一次稀疏矩阵-向量乘（遍历查询特征的倒排表累加），
+    再除以行范数得到余弦相似度。行范数依赖 idf，缓存后在该类别规模变化超过 10% 时整体重算。
+    """
+
+    NORM_DRIFT = 0.1
+
+    def __init__(self, field_weights):
+        self.field_weights = field_weights
+        self.lock = threading.RLock()
+        self._docs = {}        # item_id -> (category, frozenset(features))
+        self._postings = {}    # category -> {feature: set(item_id)}
+        self._sizes = {}       # category -> 行数
+        self._norms = {}       # item_id -> 行范数
+        self._norm_sizes = {}  # category -> 计算范数时的行数
+        self.loaded = False
+        self.synced_generation = None
+        self.synced_at = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    def _idf(self, postings, size, feature):
+        return math.log((size + 1) / (len(postings.get(feature, ())) + 1)) + 1.0
+
+    def _weight(self, postings, size, feature):
+        return self.field_weights.get(feature[0], 1.0) * self._idf(postings, size, feature)
+
+    def add(self, item_id, category, features):
+        with self.lock:
+            self.remove(item_id)
+            features = frozenset(features)
+            if not features:
+                return
+            self._docs[item_id] = (category, features)
+            self._sizes[category] = self._sizes.get(category, 0) + 1
+            postings = self._postings.setdefault(category, {})
+            for feature in features:
+                postings.setdefault(feature, set()).add(item_id)
+
+    def remove(self, item_id):
+        with self.lock:
+            doc = self._docs.pop(item_id, None)
+            self._norms.pop(item_id, None)
+            if doc is None:
+                return
+            category, features = doc
+            self._sizes[category] -= 1
+            postings = self._postings.get(category, {})
+            for feature in features:
+                ids = postings.get(feature)
+                if ids is not None:
+                    ids.discard(item_id)
+                    if not ids:
+                        del postings[feature]
+
+    def clear(self):
+        with self.lock:
+            self._docs.clear()
+            self._postings.clear()
+            self._sizes.clear()
+            self._norms.clear()
+            self._norm_sizes.clear()
+            self.loaded = False
+
+    def _norm(self, postings, size, item_id):
+        norm = self._norms.get(item_id)
+        if norm is None:
+            features = self._docs[item_id][1]
+            norm = math.sqrt(sum(self._weight(postings, size, f) ** 2 for f in features)) or 1.0
+            self._norms[item_id] = norm
+        return norm
+
+    def score(self, features, category, exclude_id=None, limit=5):
+        """返回相反类别中余弦相似度最高的 [(item_id, score)]"""
+        with self.lock:
+            postings = self._postings.get(category)
+            if not postings:
+                return []
+            size = self._sizes.get(category, 0)
+            # 类别规模漂移过大时 idf 已明显变化，丢弃该类别缓存的行范数
+            last = self._norm_sizes.get(category)
+            if last is None or abs(size - last) > last * self.NORM_DRIFT:
+                for doc_id, doc in self._docs.items():
+                    if doc[0] == category:
+                        self._norms.pop(doc_id, None)
+                self._norm_sizes[category] = size
+            query = {}
+            for feature in features:
+                if feature in postings:
+                    query[feature] = self._weight(postings, size, feature)
+            if not query:
+                return []
+            query_norm = math.sqrt(sum(w * w for w in query.values()))
+            dots = {}
+            for feature, weight in query.items():
+                # 二值词频下行权重与查询权重相同
+                contribution = weight * weight
+                for doc_id in postings[feature]:
+                    dots[doc_id] = dots.get(doc_id, 0.0) + contribution
+            dots.pop(exclude_id, None)
+            return heapq.nlargest(
+                limit,
+                ((doc_id, dot / (self._norm(postings, size, doc_id) * query_norm)) for doc_id, dot in dots.items()),
+                key=lambda pair: (pair[1], pair[0])
+            )
+
+
+item_match_index = TfidfMatchIndex(MATCH_FIELD_WEIGHTS)
+# 进行中物品的图片感知哈希索引（多索引哈希），与 item_match_index 同样按物品代数增量同步
+image_hash_index = ImageHashIndex()
+# 图片相似度在匹配总分中的权重（距离 0 时加满该值，距离达到阈值时为 0）
+IMAGE_MATCH_WEIGHT = 0.5
+
+def _load_match_rows(item_ids=None):
+    """从 item_token 读取进行中物品的特征，返回 {item_id: (category, [(field, token)])}"""
+    query = db.session.query(ItemToken.item_id, ItemToken.category, ItemToken.field, ItemToken.token)\
+        .filter(ItemToken.status == 'open')
+    if item_ids is not None:
+        query = query.filter(ItemToken.item_id.in_(item_ids))
+    docs = {}
+    for item_id, category, field, token in query.yield_per(5000):
+        docs.setdefault(item_id, (category, []))[1].append((field, token))
+    return docs
+
+def sync_item_match_index():
+    """按物品代数判断是否有写入；首次全量加载，之后只增量同步 updated_at 较新的物品"""
+    generation = get_generation(ITEMS_GENERATION)
+    index = item_match_index
+    with index.lock:
+        if index.loaded and index.synced_generation == generation:
+            return
+        started_at = datetime.now()
+        if not index.loaded:
+            for item_id, (category, features) in _load_match_rows().items():
+                index.add(item_id, category, features)
+            index.loaded = True
+            print(f'✅ 匹配引擎已加载 {len(index)} 个进行中物品')
+        else:
+            since = index.synced_at - timedelta(seconds=MATCH_INDEX_SYNC_SLACK)
+            changed = db.session.query(Item.id, Item.status).filter(Item.updated_at >= since).all()
+            open_ids = [item_id for item_id, status in changed if status == 'open']
+            for item_id, status in changed:
+                if status != 'open':
+                    index.remove(item_id)
+            docs = _load_match_rows(open_ids) if open_ids else {}
+            for item_id in open_ids:
+                if item_id in docs:
+                    index.add(item_id, *docs[item_id])
+                else:
+                    index.remove(item_id)
+        index.synced_generation = generation
+        index.synced_at = started_at
+
+def rank_item_matches(item, limit=5):
+    """在相反类别的进行中物品里按 TF-IDF 余弦相似度（叠加图片相似度）查找匹配，返回 [(Item, 分数)]"""
+    opposite_category = 'found' if item.category == 'lost' else 'lost'
+    sync_item_match_index()
+    features = [(field, token) for field, tokens in item_match_tokens(item).items() for token in tokens]
+    # 多取一些候选：被删除的物品不会出现在增量同步里，在这里校验后剔除
+    scores = dict(item_match_index.score(features, opposite_category, exclude_id=item.id, limit=limit + 10))
+    # 图片外观相似的物品额外加分（文本不相关但照片几乎相同的也会进入候选）
+    hashes = [hash_from_hex(image.dhash) for image in item.images if image.dhash]
+    if hashes:
+        for item_id, distance in visual_item_matches(hashes, opposite_category, exclude_id=item.id).items():
+            scores[item_id] = scores.get(item_id, 0.0) + IMAGE_MATCH_WEIGHT * visual_similarity(distance)
+    ranked = heapq.nlargest(limit + 10, scores.items(), key=lambda pair: (pair[1], pair[0]))
+    ids = [item_id for item_id, _ in ranked]
+    if not ids:
+        return []
+    items = {
+        i.id: i for i in Item.query.options(*item_list_options()).filter(
+            Item.id.in_(ids), Item.status == 'open', Item.category == opposite_category
+        )
+    }
+    for item_id in ids:
+        if item_id not in items:
+            item_match_index.remove(item_id)
+            image_hash_index.remove_item(item_id)
+    return [(items[i], score) for i, score in ranked if i in items][:limit]
+
+def _load_image_hash_rows(item_ids=None):
+    """读取进行中物品的图片哈希，返回 {item_id: (category, [(image_id, hash)])}"""
+    query = db.session.query(ItemImage.item_id, Item.category, ItemImage.id, ItemImage.dhash)\
+        .join(Item, Item.id == ItemImage.item_id)\
+        .filter(Item.status == 'open', ItemImage.dhash.isnot(None), ItemImage.dhash != '')
+    if item_ids is not None:
+        query = query.filter(ItemImage.item_id.in_(item_ids))
+    docs = {}
+    for item_id, category, image_id, image_hash in query.yield_per(5000):
+        docs.setdefault(item_id, (category, []))[1].append((image_id, hash_from_hex(image_hash)))
+    return docs
+
+def sync_image_hash_index():
+    """与 sync_item_match_index 相同的同步策略：首次全量加载，之后按 updated_at 增量同步"""
+    generation = get_generation(ITEMS_GENERATION)
+    index = image_hash_index
+    with index.lock:
+        if index.loaded and index.synced_generation == generation:
+            return
+        started_at = datetime.now()
+        if not index.loaded:
+            for item_id, (category, images) in _load_image_hash_rows().items():
+                index.add_item(item_id, category, images)
+            index.loaded = True
+            print(f'✅ 图片哈希索引已加载 {len(index)} 张图片')
+        else:
+            since = index.synced_at - timedelta(seconds=MATCH_INDEX_SYNC_SLACK)
+            changed = [row[0] for row in db.session.query(Item.id).filter(Item.updated_at >= since)]
+            docs = _load_image_hash_rows(changed) if changed else {}
+            for item_id in changed:
+                if item_id in docs:
+                    index.add_item(item_id, *docs[item_id])
+                else:
+                    index.remove_item(item_id)
+        index.synced_generation = generation
+        index.synced_at = started_at
+
+def visual_item_matches(hashes, category, exclude_id=None):
+    """按图片哈希查找指定类别中外观相似的进行中物品，返回 {item_id: 最小汉明距离}"""
+    max_distance = app.config['IMAGE_MATCH_MAX_DISTANCE']
+    sync_image_hash_index()
+    best = {}
+    for value in hashes:
+        for item_id, distance in image_hash_index.search(value, max_distance, category, exclude_id).items():
+            if distance < best.get(item_id, max_distance + 1):
+                best[item_id] = distance
+    return best
+
+def visual_similarity(distance):
+    return 1.0 - distance / (app.config['IMAGE_MATCH_MAX_DISTANCE'] + 1)
+
+def find_item_matches(item, limit=5):
+    """实时计算匹配，返回 Item 列表"""
+    return [match for match, _ in rank_item_matches(item, limit)]
+
+def stored_item_matches(item, limit=5):
+    """读取后台任务保存的匹配结果；对方已关闭或被改了类别的行在这里过滤掉"""
+    opposite_category = 'found' if item.category == 'lost' else 'lost'
+    return (
+        Item.query.options(*item_list_options())
+        .join(ItemMatch, ItemMatch.matched_item_id == Item.id)
+        .filter(ItemMatch.item_id == item.id, Item.status == 'open', Item.category == opposite_category)
+        .order_by(ItemMatch.score.desc(), Item.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+def trim_item_matches(item_id, limit):
+    """只保留物品分数最高的 limit 条匹配，返回被保留的 matched_item_id 集合"""
+    rows = (
+        db.session.query(ItemMatch.matched_item_id)
+        .filter(ItemMatch.item_id == item_id)
+        .order_by(ItemMatch.score.desc(), ItemMatch.matched_item_id.desc())
+        .all()
+    )
+    keep = {row[0] for row in rows[:limit]}
+    dropped = [row[0] for row in rows[limit:]]
+    if dropped:
+        ItemMatch.query.filter(
+            ItemMatch.item_id == item_id, ItemMatch.matched_item_id.in_(dropped)
+        ).delete(synchronize_session=False)
+    return keep
+
+def save_item_match(item_id, matched_item_id, score):
+    """写入或更新一行匹配；并发任务可能同时写同一对物品，用 upsert 避免主键冲突回滚整批结果"""
+    db.session.execute(
+        db.text(
+            'INSERT INTO item_match (item_id, matched_item_id, score, created_at) '
+            'VALUES (:item_id, :matched_item_id, :score, :now) '
+            'ON CONFLICT(item_id, matched_item_id) DO UPDATE SET score = excluded.score'
+        ),
+        {'item_id': item_id, 'matched_item_id': matched_item_id, 'score': score, 'now': datetime.now()}
+    )
+
+def mark_item_matches_computed(item_id):
+    db.session.execute(
+        db.text(
+            'INSERT INTO item_match_state (item_id, computed_at) VALUES (:item_id, :now) '
+            'ON CONFLICT(item_id) DO UPDATE SET computed_at = excluded.computed_at'
+        ),
+        {'item_id': item_id, 'now': datetime.now()}
+    )
+
+def compute_item_matches(item_id):
+    """计算物品的 Top-N 匹配并写入 item_match，同时把该物品写进对方的匹配列表；
+    对新出现的匹配给双方物主发通知，提交后通过 user_{id} 房间实时推送"""
+    item = Item.query.get(item_id)
+    if item is None:
+        return 0
+    limit = app.config['MATCH_TOP_N']
+    previous = {row[0] for row in db.session.query(ItemMatch.matched_item_id).filter(ItemMatch.item_id == item_id)}
+    ItemMatch.query.filter(ItemMatch.item_id == item_id).delete(synchronize_session=False)
+    # 结果为空也记录计算时间，/matches 据此直接读取而不回退到实时计算
+    mark_item_matches_computed(item_id)
+    if item.status != 'open':
+        db.session.commit()
+        return 0
+
+    matches = rank_item_matches(item, limit)
+    notifications = []
+    touched_owners = {}
+    new_matches = []
+    for other, score in matches:
+        save_item_match(item.id, other.id, score)
+        save_item_match(other.id, item.id, score)
+        # 对方列表只保留 Top-N；挤不进去说明对方已有更相关的候选，不打扰对方物主
+        kept = item.id in trim_item_matches(other.id, limit)
+        if other.id in previous:
+            continue
+        new_matches.append(other)
+        if kept and other.user_id != item.user_id:
+            notifications.append(Notification(
+                user_id=other.user_id,
+                title='发现可能的匹配',
+                content=f'新发布的{"失物" if item.category == "lost" else "拾物"}《{item.title}》'
+                        f'可能与你的《{other.title}》相关，快去看看吧！',
+                type='match',
+                related_item_id=other.id,
+            ))
+            touched_owners.setdefault(other.user_id, set()).add(other.id)
+
+    if new_matches:
+        notifications.append(Notification(
+            user_id=item.user_id,
+            title='发现可能的匹配',
+            content=f'你的《{item.title}》有 {len(new_matches)} 条可能匹配的'
+                    f'{"拾物" if item.category == "lost" else "失物"}信息，快去看看吧！',
+            type='match',
+            related_item_id=item.id,
+        ))
+    touched_owners.setdefault(item.user_id, set()).add(item.id)
+    db.session.add_all(notifications)
+    db.session.flush()
+    for notification in notifications:
+        queue_realtime_notification(notification.user_id, notification.to_dict())
+    for owner_id, item_ids in touched_owners.items():
+        queue_realtime_event(owner_id, 'item_matches_updated', {'item_ids': sorted(item_ids)})
+    db.session.commit()
+    return len(matches)
+
+def run_item_match_task(item_id):
+    with app.app_context():
+        try:
+            count = compute_item_matches(item_id)
+            print(f'[DEBUG] 物品 {item_id} 匹配计算完成，共 {count} 条')
+        except Exception as e:
+            db.session.rollback()
+            print(f'[ERROR] 物品 {item_id} 匹配计算失败: {e}')
+
+def schedule_item_matches(item_id):
+    """在后台线程计算匹配（调用方需已提交物品）"""
+    socketio.start_background_task(run_item_match_task, item_id)
+
+# ==================== 订阅搜索（反向匹配） ====================
+# 订阅的搜索词切分后写入 saved_search_term；新物品发布时用物品的词元集合反查倒排表，
+# 只有全部词元都命中的订阅（命中数 = term_count）才会被取出再校验类别/类型，
+# 因此每次发布的开销取决于命中的订阅数，而不是订阅总数。
+# 没有搜索词的订阅以 type:/category: 伪词元作为锚点，同样走倒排表。
+
+def saved_search_terms(search, category='', item_type=''):
+    """返回订阅需要全部命中的词元；无搜索词时退化为类型/类别锚点，全部为空返回空集合"""
+    terms = set(token_set(search or '', MATCH_TOKEN_MAX_LENGTH))
+    if not terms:
+        if item_type:
+            terms.add(f'type:{item_type}')
+        elif category:
+            terms.add(f'category:{category}')
+    return terms
+
+def item_percolate_tokens(item):
+    """物品用于反查订阅的词元：标题/描述/地点/类型的词元 + 类型、类别锚点"""
+    tokens = set(token_set(
+        f'{item.title or ""} {item.description or ""} {item.location or ""} {item.item_type or ""}',
+        MATCH_TOKEN_MAX_LENGTH
+    ))
+    tokens.add(f'type:{item.item_type}')
+    tokens.add(f'category:{item.category}')
+    return tokens
+
+def set_saved_search_terms(saved_search):
+    terms = saved_search_terms(saved_search.search, saved_search.category, saved_search.item_type)
+    SavedSearchTerm.query.filter_by(saved_search_id=saved_search.id).delete(synchronize_session=False)
+    db.session.add_all(SavedSearchTerm(saved_search_id=saved_search.id, token=t) for t in terms)
+    saved_search.term_count = len(terms)
+
+def matching_saved_searches(item):
+    """返回与物品匹配的订阅（不含发布者自己的订阅）"""
+    tokens = list(item_percolate_tokens(item))
+    hits = (
+        db.session.query(SavedSearchTerm.saved_search_id, db.func.count().label('hits'))
+        .filter(SavedSearchTerm.token.in_(tokens))
+        .group_by(SavedSearchTerm.saved_search_id)
+        .subquery()
+    )
+    return (
+        SavedSearch.query.join(hits, hits.c.saved_search_id == SavedSearch.id)
+        .filter(
+            hits.c.hits == SavedSearch.term_count,
+            SavedSearch.user_id != item.user_id,
+            (SavedSearch.category.is_(None)) | (SavedSearch.category == '') | (SavedSearch.category == item.category),
+            (SavedSearch.item_type.is_(None)) | (SavedSearch.item_type == '') | (SavedSearch.item_type == item.item_type),
+        )
+        .all()
+    )
+
+def percolate_saved_searches(item_id):
+    """新物品发布后通知订阅命中的用户：每个用户一条通知（多个订阅命中时合并）"""
+    item = Item.query.get(item_id)
+    if item is None or item.status != 'open':
+        return 0
+    by_user = {}
+    for saved_search in matching_saved_searches(item):
+        by_user.setdefault(saved_search.user_id, []).append(saved_search)
+    now = datetime.now()
+    kind = '失物' if item.category == 'lost' else '拾物'
+    notifications = []
+    for user_id, searches in by_user.items():
+        names = '、'.join(f'“{s.name or s.search or s.item_type or kind}”' for s in searches[:3])
+        notifications.append(Notification(
+            user_id=user_id,
+            title='订阅有新物品',
+            content=f'新发布的{kind}《{item.title}》符合你订阅的搜索 {names}',
+            type='subscription',
+            related_item_id=item.id,
+        ))
+        for saved_search in searches:
+            saved_search.last_notified_at = now
+    db.session.add_all(notifications)
+    db.session.flush()
+    for notification in notifications:
+        queue_realtime_notification(notification.user_id, notification.to_dict())
+    db.session.commit()
+    return len(notifications)
+
+def run_saved_search_task(item_id):
+    with app.app_context():
+        try:
+            count = percolate_saved_searches(item_id)
+            print(f'[DEBUG] 物品 {item_id} 订阅匹配完成，通知 {count} 位用户')
+        except Exception as e:
+            db.session.rollback()
+            print(f'[ERROR] 物品 {item_id} 订阅匹配失败: {e}')
+
+def schedule_saved_search_percolation(item_id):
+    """在后台线程反查订阅（调用方需已提交物品）"""
+    socketio.start_background_task(run_saved_search_task, item_id)
+
+def search_hits_subquery(match_query):
+    """返回 (item_id, score) 子查询，score 为 bm25 值（越小越相关）"""
+    weights = ', '.join(str(w) for w in SEARCH_FTS_WEIGHTS)
+    return db.text(
+        f'SELECT rowid AS item_id, bm25(item_fts, {weights}) AS score '
+        'FROM item_fts WHERE item_fts MATCH :match_query'
+    ).bindparams(match_query=match_query).columns(
+        item_id=db.Integer, score=db.Float
+    ).subquery('search_hits')
+
+# ==================== 列表响应缓存 ====================
+# 缓存键包含代数：写操作递增代数后旧条目不会再被命中，只等待 LRU 淘汰或 TTL 过期。
+# 代数存在数据库中并随写操作一起提交，多进程部署下同样生效。
+ITEMS_GENERATION = 'items'
+
+# 物品响应带有物主用户名：用户名变化时由触发器递增物品代数，任何写入路径（包括脚本）都会让列表缓存失效
+USER_ITEMS_TRIGGERS = {
+    'trg_user_items_generation': """
+        CREATE TRIGGER trg_user_items_generation AFTER UPDATE OF username ON user
+        WHEN OLD.username IS NOT NEW.username
+        BEGIN
+            INSERT INTO cache_generation (name, value) VALUES ('items', 1)
+            ON CONFLICT(name) DO UPDATE SET value = value + 1;
+        END
+    """,
+}
+
+def get_generation(name):
+    value = db.session.execute(
+        db.text('SELECT value FROM cache_generation WHERE name = :name'), {'name': name}
+    ).scalar()
+    return value or 0
+
+def bump_generation(name):
+    """在调用方事务内递增代数（随调用方 commit 生效）"""
+    db.session.execute(
+        db.text(
+            'INSERT INTO cache_generation (name, value) VALUES (:name, 1) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + 1'
+        ),
+        {'name': name}
+    )
+
+def set_generation(name, value):
+    db.session.execute(
+        db.text(
+            'INSERT INTO cache_generation (name, value) VALUES (:name, :value) '
+            'ON CONFLICT(name) DO UPDATE SET value = :value'
+        ),
+        {'name': name, 'value': value}
+    )
+
+def bump_items_generation():
+    bump_generation(ITEMS_GENERATION)
+
+class ResponseCache:
+    """线程安全的 LRU + TTL 缓存，值为已编码好的 JSON 字节串"""
+
+    def __init__(self, maxsize=256, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, body = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, body)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+items_response_cache = ResponseCache(app.config['ITEMS_CACHE_MAXSIZE'], app.config['ITEMS_CACHE_TTL'])
+
+# 物品词元集合缓存：键含 updated_at，物品修改后自然换用新键（值为 {字段: frozenset}）
+item_token_cache = ResponseCache(maxsize=4096, ttl=3600)
+
+# ==================== 条件请求（ETag / Last-Modified） ====================
+# ETag 只由版本信息（updated_at、代数等）计算，命中 If-None-Match 时直接返回 304，不再查询明细和序列化
+def comments_generation_name(item_id):
+    return f'comments:{item_id}'
+
+def bump_comments_generation(item_id):
+    bump_generation(comments_generation_name(item_id))
+
+def make_etag(*parts):
+    return hashlib.sha1('|'.join(str(p) for p in parts).encode('utf-8')).hexdigest()
+
+def conditional_response(etag, build, last_modified=None):
+    """客户端缓存仍有效时返回 304，否则调用 build() 生成响应；两种情况都附带校验头"""
+    if last_modified is not None:
+        # 本地时间 -> UTC，HTTP 日期只精确到秒
+        last_modified = last_modified.replace(microsecond=0).astimezone(timezone.utc)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        since = request.if_modified_since
+        not_modified = bool(last_modified and since and last_modified <= since)
+    if not_modified:
+        response = app.response_class(status=304)
+    else:
+        response = make_response(build())
+        if response.status_code != 200:
+            return response
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # 允许客户端缓存，但每次使用前都要回源校验
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+# ==================== 未读计数 ====================
+# user_counter 每个用户一行，读取未读数只需一次主键查询。
+# 所有写入通知/消息、标记已读的路径都通过 adjust_unread_counters 在调用方事务内增减，
+# 同时排队推送 unread_delta；其他途径（删除用户、直接改库等）造成的偏差由 reconcile_unread_counters 校正。
+
+UNREAD_COUNTERS_GENERATION = 'unread_counters'  # 非 0 表示已完成首次全量回填
+UNREAD_COUNTER_BATCH_SIZE = 1000
+
+def adjust_unread_counters_many(user_ids, notifications=0, messages=0):
+    """给多个用户的未读计数加上相同的增量（一次 executemany，在调用方事务内执行）"""
+    user_ids = list(user_ids)
+    if not user_ids or not (notifications or messages):
+        return
+    now = datetime.now()
+    db.session.execute(
+        db.text(
+            'INSERT INTO user_counter (user_id, unread_notifications, unread_messages, updated_at) '
+            'VALUES (:user_id, MAX(:notifications, 0), MAX(:messages, 0), :now) '
+            'ON CONFLICT(user_id) DO UPDATE SET '
+            'unread_notifications = MAX(unread_notifications + :notifications, 0), '
+            'unread_messages = MAX(unread_messages + :messages, 0), '
+            'updated_at = :now'
+        ),
+        [{'user_id': user_id, 'notifications': notifications, 'messages': messages, 'now': now} for user_id in user_ids]
+    )
+    for user_id in user_ids:
+        queue_unread_delta(user_id, notifications=notifications, messages=messages)
+
+def adjust_unread_counters(user_id, notifications=0, messages=0):
+    adjust_unread_counters_many([user_id], notifications=notifications, messages=messages)
+
+def unread_counts(user_id):
+    """未读通知数与未读私信数（主键读取；没有计数行视为 0）"""
+    row = db.session.execute(
+        db.text('SELECT unread_notifications, unread_messages FROM user_counter WHERE user_id = :user_id'),
+        {'user_id': user_id}
+    ).first()
+    return {'notifications': row[0] if row else 0, 'messages': row[1] if row else 0}
+
+def reconcile_unread_counters():
+    """按实际数据重算未读计数（按用户 id 分批，每批一条语句原子执行），返回被修正的用户数"""
+    fixed = 0
+    last_id = 0
+    while True:
+        ids = [row[0] for row in db.session.execute(
+            db.text('SELECT id FROM user WHERE id > :last_id ORDER BY id LIMIT :limit'),
+            {'last_id': last_id, 'limit': UNREAD_COUNTER_BATCH_SIZE}
+        )]
+        if not ids:
+            break
+        result = db.session.execute(
+            db.text(
+                'INSERT INTO user_counter (user_id, unread_notifications, unread_messages, updated_at) '
+                'SELECT u.id, '
+                '(SELECT COUNT(*) FROM notification n WHERE n.user_id = u.id AND n.is_read = 0), '
+                '(SELECT COUNT(*) FROM message m WHERE m.receiver_id = u.id AND m.is_read = 0 '
+                ' AND m.is_deleted_by_receiver = 0), '
+                ':now FROM user u WHERE u.id > :low AND u.id <= :high '
+                'ON CONFLICT(user_id) DO UPDATE SET '
+                'unread_notifications = excluded.unread_notifications, '
+                'unread_messages = excluded.unread_messages, '
+                'updated_at = excluded.updated_at '
+                'WHERE unread_notifications != excluded.unread_notifications '
+                'OR unread_messages != excluded.unread_messages'
+            ),
+            {'now': datetime.now(), 'low': last_id, 'high': ids[-1]}
+        )
+        fixed += max(result.rowcount or 0, 0)
+        db.session.commit()
+        last_id = ids[-1]
+    return fixed
+
+def run_unread_counter_reconciler(interval):
+    """定时校正未读计数的后台循环"""
+    while True:
+        socketio.sleep(interval)
+        with app.app_context():
+            try:
+                fixed = reconcile_unread_counters()
+                if fixed:
+                    print(f'✅ 未读计数已校正：{fixed} 位用户')
+            except Exception as e:
+                db.session.rollback()
+                print(f'[ERROR] 未读计数校正失败: {e}')
+
+# ==================== 通知归档 ====================
+NOTIFICATION_COLUMNS = 'user_id, title, content, type, is_read, created_at, related_item_id, count, last_time'
+
+def archive_read_notifications(retention_days=None, batch_size=None):
+    """把早于保留天数的已读通知按 id 分批移入 notification_archive（每批一个事务），返回归档条数"""
+    retention_days = app.config['NOTIFICATION_RETENTION_DAYS'] if retention_days is None else retention_days
+    batch_size = batch_size or app.config['NOTIFICATION_ARCHIVE_BATCH_SIZE']
+    if retention_days <= 0:
+        return 0
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    archived = 0
+    last_id = 0
+    while True:
+        ids = [row[0] for row in db.session.execute(
+            db.text(
+                'SELECT id FROM notification WHERE is_read = 1 AND created_at < :cutoff AND id > :last_id '
+                'ORDER BY id LIMIT :limit'
+            ),
+            {'cutoff': cutoff, 'last_id': last_id, 'limit': batch_size}
+        )]
+        if not ids:
+            break
+        params = {f'id{i}': notification_id for i, notification_id in enumerate(ids)}
+        placeholders = ', '.join(f':id{i}' for i in range(len(ids)))
+        # 复查 is_read，跳过选出后又被改动的行
+        db.session.execute(
+            db.text(
+                f'INSERT INTO notification_archive (notification_id, {NOTIFICATION_COLUMNS}, archived_at) '
+                f'SELECT id, {NOTIFICATION_COLUMNS}, :now FROM notification WHERE id IN ({placeholders}) AND is_read = 1'
+            ),
+            {**params, 'now': datetime.now()}
+        )
+        result = db.session.execute(
+            db.text(f'DELETE FROM notification WHERE id IN ({placeholders}) AND is_read = 1'),
+            params
+        )
+        db.session.commit()
+        archived += max(result.rowcount or 0, 0)
+        last_id = ids[-1]
+    return archived
+
+def run_notification_archiver(interval):
+    """定时归档已读旧通知的后台循环"""
+    while True:
+        with app.app_context():
+            try:
+                archived = archive_read_notifications()
+                if archived:
+                    print(f'✅ 已归档 {archived} 条已读通知')
+            except Exception as e:
+                db.session.rollback()
+                print(f'[ERROR] 通知归档失败: {e}')
+        socketio.sleep(interval)
+
+# ==================== 分面计数 ====================
+# item_facet_count 由触发器在 item 的增删改时同步维护，任何写入路径（包括脚本）都不会漏计
+ITEM_FACET_TRIGGERS = {
+    'trg_item_facet_insert': """
+        CREATE TRIGGER trg_item_facet_insert AFTER INSERT ON item BEGIN
+            INSERT INTO item_facet_count (category, item_type, status, count)
+            VALUES (NEW.category, NEW.item_type, COALESCE(NEW.status, ''), 1)
+            ON CONFLICT(category, item_type, status) DO UPDATE SET count = count + 1;
+        END
+    """,
+    'trg_item_facet_delete': """
+        CREATE TRIGGER trg_item_facet_delete AFTER DELETE ON item BEGIN
+            UPDATE item_facet_count SET count = count - 1
+            WHERE category = OLD.category AND item_type = OLD.item_type AND status = COALESCE(OLD.status, '');
+        END
+    """,
+    'trg_item_facet_update': """
+        CREATE TRIGGER trg_item_facet_update AFTER UPDATE OF category, item_type, status ON item
+        WHEN OLD.category IS NOT NEW.category OR OLD.item_type IS NOT NEW.item_type OR OLD.status IS NOT NEW.status
+        BEGIN
+            UPDATE item_facet_count SET count = count - 1
+            WHERE category = OLD.category AND item_type = OLD.item_type AND status = COALESCE(OLD.status, '');
+            INSERT INTO item_facet_count (category, item_type, status, count)
+            VALUES (NEW.category, NEW.item_type, COALESCE(NEW.status, ''), 1)
+            ON CONFLICT(category, item_type, status) DO UPDATE SET count = count + 1;
+        END
+    """,
+}
+
+def rebuild_item_facet_counts():
+    """按 item 表重新统计分面计数（用于首次建表或修正偏差）"""
+    db.session.execute(db.text('DELETE FROM item_facet_count'))
+    db.session.execute(db.text(
+        "INSERT INTO item_facet_count (category, item_type, status, count) "
+        "SELECT category, item_type, COALESCE(status, ''), COUNT(*) FROM item "
+        "GROUP BY category, item_type, COALESCE(status, '')"
+    ))
+    db.session.commit()
+
+def rollup_facets(rows, category='', item_type='', status=''):
+    """把 (category, item_type, status, count) 明细汇总为三个分面。
+    每个分面只应用其余两个维度的筛选条件，便于前端展示切换后的数量"""
+    facets = {'category': {}, 'item_type': {}, 'status': {}}
+    total = 0
+    for row_category, row_item_type, row_status, count in rows:
+        if not count:
+            continue
+        match_category = not category or row_category == category
+        match_item_type = not item_type or row_item_type == item_type
+        match_status = not status or row_status == status
+        if match_item_type and match_status:
+            facets['category'][row_category] = facets['category'].get(row_category, 0) + count
+        if match_category and match_status:
+            facets['item_type'][row_item_type] = facets['item_type'].get(row_item_type, 0) + count
+        if match_category and match_item_type:
+            facets['status'][row_status] = facets['status'].get(row_status, 0) + count
+            total += count
+    facets['total'] = total
+    return facets
+
+def item_facet_rows(search='', start_date='', end_date=''):
+    """无搜索/日期条件时直接读维护好的计数表，否则执行一次分组查询"""
+    if not search and not (start_date and end_date):
+        return db.session.query(
+            ItemFacetCount.category, ItemFacetCount.item_type, ItemFacetCount.status, ItemFacetCount.count
+        ).filter(ItemFacetCount.count > 0).all()
+    query, _ = filtered_items_query(search=search, start_date=start_date, end_date=end_date)
+    # 与计数表一致，空状态归为 ''，否则 None 与字符串混在同一分面里无法排序序列化
+    status = db.func.coalesce(Item.status, '')
+    return query.with_entities(
+        Item.category, Item.item_type, status, db.func.count(Item.id)
+    ).group_by(Item.category, Item.item_type, status).all()
+
 # 创建数据库表
 with app.app_context():
     db.create_all()
@@ -670,12 +2159,157 @@ with app.app_context():
         # 添加多张图片路径字段
         if 'images_path' not in cols:
             cur.execute("ALTER TABLE item ADD COLUMN images_path TEXT")
+        # 添加规范化日期字段及索引
+        if 'date_value' not in cols:
+            cur.execute("ALTER TABLE item ADD COLUMN date_value DATE")
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_item_date_value ON item (date_value)")
+        # 添加更新时间字段，旧数据以发布时间作为初始版本
+        if 'updated_at' not in cols:
+            cur.execute("ALTER TABLE item ADD COLUMN updated_at DATETIME")
+            cur.execute("UPDATE item SET updated_at = created_at WHERE updated_at IS NULL")
         conn.commit()
         conn.close()
         print('✅ Item 表迁移成功：已添加 images_path 字段')
     except Exception as e:
         print(f'item migration skipped: {e}')
 
+    # 回填 date_value（按 id 分批，只处理尚未回填的行）
+    try:
+        import sqlite3
+        conn = sqlite3.connect(os.path.join(basedir, 'lost_found.db'))
+        cur = conn.cursor()
+        last_id = 0
+        backfilled = 0
+        while True:
+            cur.execute(
+                "SELECT id, date FROM item WHERE date_value IS NULL AND id > ? ORDER BY id LIMIT 1000",
+                (last_id,)
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            updates = []
+            for row_id, raw_date in rows:
+                parsed = parse_item_date(raw_date)
+                if parsed:
+                    updates.append((parsed.isoformat(), row_id))
+            if updates:
+                cur.executemany("UPDATE item SET date_value = ? WHERE id = ?", updates)
+                backfilled += len(updates)
+            last_id = rows[-1][0]
+        conn.commit()
+        conn.close()
+        if backfilled:
+            print(f'✅ Item 表已回填 date_value：{backfilled} 条')
+    except Exception as e:
+        print(f'item date_value backfill skipped: {e}')
+
+    # 未读查询与计数校正使用的索引；通知合并字段
+    try:
+        import sqlite3
+        conn = sqlite3.connect(os.path.join(basedir, 'lost_found.db'))
+        cur = conn.cursor()
+        for table, coldefs in (
+            ('notification', [('coalesce_key', 'VARCHAR(100)'), ('count', 'INTEGER DEFAULT 1'), ('last_time', 'DATETIME')]),
+            ('notification_archive', [('notification_id', 'INTEGER'), ('count', 'INTEGER DEFAULT 1'), ('last_time', 'DATETIME')]),
+        ):
+            cur.execute(f"PRAGMA table_info({table})")
+            cols = [row[1] for row in cur.fetchall()]
+            for name, coltype in coldefs:
+                if name not in cols:
+                    cur.execute(f"ALTER TABLE {table} ADD COLUMN {name} {coltype}")
+                    if name == 'notification_id':
+                        # 早期归档行的主键即原通知 id
+                        cur.execute("UPDATE notification_archive SET notification_id = id")
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS ix_notification_coalesce ON notification (user_id, coalesce_key, is_read)"
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_notification_user_read ON notification (user_id, is_read)")
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_notification_user_created ON notification (user_id, created_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_message_receiver_read ON message (receiver_id, is_read)")
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f'unread index migration skipped: {e}')
+
+    # item_image 添加感知哈希字段，已有图片按 id 分批回填
+    try:
+        import sqlite3
+        conn = sqlite3.connect(os.path.join(basedir, 'lost_found.db'))
+        cur = conn.cursor()
+        cur.execute("PRAGMA table_info(item_image)")
+        cols = [row[1] for row in cur.fetchall()]
+        if 'dhash' not in cols:
+            cur.execute("ALTER TABLE item_image ADD COLUMN dhash VARCHAR(16)")
+            conn.commit()
+        last_id = 0
+        hashed = 0
+        while True:
+            cur.execute("SELECT id, path FROM item_image WHERE dhash IS NULL AND id > ? ORDER BY id LIMIT 500", (last_id,))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            cur.executemany(
+                "UPDATE item_image SET dhash = ? WHERE id = ?",
+                [(read_image_meta(path)[3], row_id) for row_id, path in rows]
+            )
+            conn.commit()
+            hashed += len(rows)
+            last_id = rows[-1][0]
+        conn.close()
+        if hashed:
+            print(f'✅ 物品图片已回填感知哈希：{hashed} 张')
+    except Exception as e:
+        print(f'item image hash backfill skipped: {e}')
+
+    # 把旧版 image_path / images_path 迁移到 item_image 表（按 id 分批，迁移后清空旧字段）
+    try:
+        import sqlite3
+        conn = sqlite3.connect(os.path.join(basedir, 'lost_found.db'))
+        cur = conn.cursor()
+        last_id = 0
+        migrated = 0
+        while True:
+            cur.execute(
+                "SELECT id, image_path, images_path FROM item "
+                "WHERE (image_path IS NOT NULL OR images_path IS NOT NULL) AND id > ? ORDER BY id LIMIT 500",
+                (last_id,)
+            )
+            rows = cur.fetchall()
+            if not rows:
+                break
+            image_rows = []
+            for row_id, image_path, images_path in rows:
+                paths = []
+                if images_path:
+                    try:
+                        decoded = json.loads(images_path)
+                        if isinstance(decoded, list):
+                            paths = [p for p in decoded if p]
+                    except Exception:
+                        pass
+                # 与旧版 to_dict 一致：没有多图时回退到主图
+                if not paths and image_path:
+                    paths = [image_path]
+                for position, path in enumerate(paths):
+                    width, height, size, image_hash = read_image_meta(path)
+                    image_rows.append((row_id, position, path, width, height, size, image_hash))
+            cur.execute("DELETE FROM item_image WHERE item_id IN (%s)" % ','.join('?' * len(rows)), [r[0] for r in rows])
+            cur.executemany(
+                "INSERT INTO item_image (item_id, position, path, width, height, bytes, dhash, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                image_rows
+            )
+            cur.executemany("UPDATE item SET image_path = NULL, images_path = NULL WHERE id = ?", [(r[0],) for r in rows])
+            conn.commit()
+            migrated += len(rows)
+            last_id = rows[-1][0]
+        conn.close()
+        if migrated:
+            print(f'✅ 物品图片已迁移到 item_image 表：{migrated} 个物品')
+    except Exception as e:
+        print(f'item image migration skipped: {e}')
+
     try:
         import sqlite3
         conn = sqlite3.connect(os.path.join(basedir, 'lost_found.db'))
@@ -713,6 +2347,22 @@ with app.app_context():
     except Exception as e:
         db.session.rollback()
         print(f'super admin seed skipped: {e}')
+
+    # 首次启动时把默认词表写入 sensitive_term，写入与标记在同一事务提交
+    try:
+        if not get_generation(SENSITIVE_TERMS_SEEDED):
+            # 标记出现之前已初始化并由管理员维护过的词库，只补记标记
+            if not (get_generation(SENSITIVE_WORDS_GENERATION) and SensitiveTerm.query.first()):
+                for kind, terms in ((SENSITIVE_TERM_WORD, SENSITIVE_WORDS), (SENSITIVE_TERM_SAFE, SAFE_PHRASES)):
+                    for term in dict.fromkeys(terms):
+                        db.session.add(SensitiveTerm(term=term, kind=kind))
+                bump_generation(SENSITIVE_WORDS_GENERATION)
+                print('✅ 已初始化敏感词库')
+            set_generation(SENSITIVE_TERMS_SEEDED, 1)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f'sensitive term seed skipped: {e}')
     
     # 创建新表（如果不存在）
     try:
@@ -816,6 +2466,121 @@ with app.app_context():
     except Exception as e:
         print(f'新表创建失败: {e}')
 
+    # 游标分页所需的复合索引（旧库补建）
+    try:
+        import sqlite3
+        conn = sqlite3.connect(os.path.join(basedir, 'lost_found.db'))
+        cur = conn.cursor()
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_item_created_at_id ON item (created_at, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_item_status_created_at_id ON item (status, created_at, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_item_user_created_at_id ON item (user_id, created_at, id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_item_updated_at ON item (updated_at)")
+        cur.execute("CREATE INDEX IF NOT EXISTS ix_favorite_user_created_at_id ON favorite (user_id, created_at, id)")
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f'pagination index migration skipped: {e}')
+
+    # 全文搜索索引（FTS5）：首次创建时对已有物品全量建索引
+    try:
+        fts_exists = db.session.execute(
+            db.text("SELECT name FROM sqlite_master WHERE type='table' AND name='item_fts'")
+        ).first() is not None
+        if not fts_exists:
+            db.session.execute(db.text(
+                f"CREATE VIRTUAL TABLE item_fts USING fts5("
+                f"{', '.join(SEARCH_FTS_COLUMNS)}, tokenize='unicode61')"
+            ))
+            db.session.commit()
+        SEARCH_FTS_ENABLED = True
+        if not fts_exists:
+            indexed = rebuild_item_search_index()
+            print(f'✅ 搜索索引创建成功，已索引 {indexed} 条物品')
+    except Exception as e:
+        db.session.rollback()
+        SEARCH_FTS_ENABLED = False
+        print(f'search index setup skipped (fallback to LIKE): {e}')
+
+    # 分面计数触发器：新建触发器时按现有数据重算一次计数
+    try:
+        existing_triggers = {
+            row[0] for row in db.session.execute(
+                db.text("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'trg_item_facet_%'")
+            )
+        }
+        missing_triggers = [name for name in ITEM_FACET_TRIGGERS if name not in existing_triggers]
+        for name in missing_triggers:
+            db.session.execute(db.text(ITEM_FACET_TRIGGERS[name]))
+        db.session.commit()
+        if missing_triggers:
+            rebuild_item_facet_counts()
+            print('✅ 分面计数触发器创建成功，已重算计数')
+    except Exception as e:
+        db.session.rollback()
+        print(f'facet counter setup skipped: {e}')
+
+    # 用户名变化时使物品列表缓存失效
+    try:
+        existing_triggers = {
+            row[0] for row in db.session.execute(
+                db.text("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'trg_user_items_%'")
+            )
+        }
+        for name in USER_ITEMS_TRIGGERS:
+            if name not in existing_triggers:
+                db.session.execute(db.text(USER_ITEMS_TRIGGERS[name]))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f'user items trigger setup skipped: {e}')
+
+    # 匹配推荐索引：首次创建同步触发器时对已有物品全量建索引
+    try:
+        existing_triggers = {
+            row[0] for row in db.session.execute(
+                db.text("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'trg_item_token_%'")
+            )
+        }
+        missing_triggers = [name for name in ITEM_TOKEN_TRIGGERS if name not in existing_triggers]
+        for name in missing_triggers:
+            db.session.execute(db.text(ITEM_TOKEN_TRIGGERS[name]))
+        db.session.commit()
+        # 分词规则升级后同样需要重建
+        if missing_triggers or get_generation(MATCH_TOKENIZER_GENERATION) != TOKENIZER_VERSION:
+            indexed = rebuild_item_match_index()
+            set_generation(MATCH_TOKENIZER_GENERATION, TOKENIZER_VERSION)
+            db.session.commit()
+            print(f'✅ 匹配索引已重建（分词版本 {TOKENIZER_VERSION}），已索引 {indexed} 条物品')
+    except Exception as e:
+        db.session.rollback()
+        print(f'match index setup skipped: {e}')
+
+    # 匹配结果表：物品删除时清理双向的匹配行
+    try:
+        existing_triggers = {
+            row[0] for row in db.session.execute(
+                db.text("SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'trg_item_match_%'")
+            )
+        }
+        for name in ITEM_MATCH_TRIGGERS:
+            if name not in existing_triggers:
+                db.session.execute(db.text(ITEM_MATCH_TRIGGERS[name]))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f'match result setup skipped: {e}')
+
+    # 未读计数：首次启用时按现有通知/消息全量回填
+    try:
+        if not get_generation(UNREAD_COUNTERS_GENERATION):
+            fixed = reconcile_unread_counters()
+            set_generation(UNREAD_COUNTERS_GENERATION, 1)
+            db.session.commit()
+            print(f'✅ 未读计数已初始化：{fixed} 位用户')
+    except Exception as e:
+        db.session.rollback()
+        print(f'unread counter setup skipped: {e}')
+
 # 文件上传辅助函数
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'bmp', 'avif', 'svg', 'tiff', 'tif', 'ico', 'heic', 'heif'}
 MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB
@@ -836,16 +2601,121 @@ def file_too_large(file, limit=MAX_IMAGE_SIZE):
         # 回退：不确定大小时认为未超限
         return False
 
-def create_notification(user_id, title, content, notification_type='info', related_item_id=None):
+def create_notification(user_id, title, content, notification_type='info', related_item_id=None,
+                        coalesce_key=None, coalesced_content=None):
+    """创建通知并提交。
+
+    传入 coalesce_key 时，若该用户同一 key 的未读通知创建于合并窗口内，则不新增行：
+    累加 count、刷新 last_time，内容改为 coalesced_content 并把其中的 {count} 替换为合并次数（未提供时沿用 content）。
+    收件箱排序与分页游标都按 created_at，窗口也以 created_at 为界，合并行不会长期停在旧位置；
+    last_time 只用于展示最近一次发生的时间。
+    """
+    now = datetime.now()
+    window = app.config['NOTIFICATION_COALESCE_WINDOW']
+    if coalesce_key and window > 0:
+        existing = Notification.query.filter(
+            Notification.user_id == user_id,
+            Notification.coalesce_key == coalesce_key,
+            Notification.is_read == False,
+            Notification.created_at >= now - timedelta(seconds=window)
+        ).order_by(Notification.id.desc()).first()
+        if existing:
+            existing.count = (existing.count or 1) + 1
+            existing.last_time = now
+            existing.title = title
+            existing.content = coalesced_content.replace('{count}', str(existing.count)) if coalesced_content else content
+            # 行仍为未读，未读数不变，只推送更新后的内容
+            queue_realtime_event(user_id, 'notification_updated', existing.to_dict())
+            db.session.commit()
+            return existing
     notification = Notification(
         user_id=user_id,
         title=title,
         content=content,
         type=notification_type,
-        related_item_id=related_item_id
+        related_item_id=related_item_id,
+        coalesce_key=coalesce_key,
+        count=1,
+        last_time=now
     )
     db.session.add(notification)
+    db.session.flush()
+    queue_realtime_notification(user_id, notification.to_dict())
     db.session.commit()
+    return notification
+
+# ==================== 实时推送 ====================
+# 通过 user_{id} 房间推送的事件：
+#   new_notification  新通知内容
+#   unread_delta      未读数变化 {'notifications': ±n, 'messages': ±n}
+#   unread_counts     未读数快照（连接时发送），客户端据此初始化角标，无需轮询
+#   notification_updated  合并通知被更新（count/last_time/内容变化，未读数不变）
+# 待推送事件挂在 session.info 上，事务提交后才发出，回滚则丢弃
+
+PENDING_REALTIME_KEY = 'pending_realtime_events'
+
+def queue_realtime_event(user_id, event_name, payload):
+    db.session.info.setdefault(PENDING_REALTIME_KEY, []).append((user_id, event_name, payload))
+
+def queue_unread_delta(user_id, notifications=0, messages=0):
+    if notifications or messages:
+        queue_realtime_event(user_id, 'unread_delta', {'notifications': notifications, 'messages': messages})
+
+def queue_realtime_notification(user_id, payload):
+    """新通知已写入调用方事务：增加未读计数，并在提交后推送"""
+    queue_realtime_event(user_id, 'new_notification', payload)
+    adjust_unread_counters(user_id, notifications=1)
+
+@event.listens_for(OrmSession, 'after_commit')
+def _send_pending_realtime_events(session):
+    for user_id, event_name, payload in session.info.pop(PENDING_REALTIME_KEY, None) or ():
+        try:
+            socketio.emit(event_name, payload, room=f'user_{user_id}')
+        except Exception as e:
+            print(f'[ERROR] 实时推送失败: user={user_id}, event={event_name}, 错误: {e}')
+
+@event.listens_for(OrmSession, 'after_soft_rollback')
+def _discard_pending_realtime_events(session, previous_transaction):
+    session.info.pop(PENDING_REALTIME_KEY, None)
+
+def notify_many(user_ids, title, content, notification_type='info', related_item_id=None):
+    """给多个用户发送同一条通知：一条批量 INSERT 写入调用方事务（不提交），提交后逐个实时推送。
+    返回新通知的 id 列表"""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return []
+    now = datetime.now()
+    rows = [{
+        'user_id': user_id,
+        'title': title,
+        'content': content,
+        'type': notification_type,
+        'is_read': False,
+        'created_at': now,
+        'related_item_id': related_item_id,
+        'count': 1,
+        'last_time': now
+    } for user_id in user_ids]
+    result = db.session.execute(
+        db.insert(Notification).returning(Notification.id, Notification.user_id),
+        rows
+    )
+    ids = []
+    for notification_id, user_id in result:
+        ids.append(notification_id)
+        queue_realtime_event(user_id, 'new_notification', {
+            'id': notification_id,
+            'title': title,
+            'content': content,
+            'type': notification_type,
+            'is_read': False,
+            'created_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'related_item_id': related_item_id,
+            'count': 1,
+            'last_time': now.strftime('%Y-%m-%d %H:%M:%S')
+        })
+    adjust_unread_counters_many(user_ids, notifications=1)
+    return ids
 
 # JWT 错误处理
 @jwt.invalid_token_loader
@@ -870,6 +2740,8 @@ def add_cors_headers(response):
     response.headers['Access-Control-Allow-Credentials'] = 'true'
     response.headers['Access-Control-Allow-Headers'] = 'authorization, content-type'
     response.headers['Access-Control-Allow-Methods'] = 'DELETE, GET, HEAD, OPTIONS, PATCH, POST, PUT'
+    # 旧版通知列表通过响应头提示截断（响应体仍为数组）
+    response.headers['Access-Control-Expose-Headers'] = 'X-Has-More, X-Next-Cursor'
     return response
 
 @app.before_request
@@ -1085,22 +2957,19 @@ def create_report():
         anonymous=bool(str(data.get('anonymous', 'false')).lower() in ['true','1','yes'])
     )
     db.session.add(report)
-    db.session.commit()
 
-    admins = User.query.filter(User.role.in_([ROLE_ADMIN, ROLE_SUPER_ADMIN])).all()
+    # 举报与给全部管理员的通知在同一事务内提交
+    admin_ids = [row[0] for row in db.session.query(User.id).filter(User.role.in_([ROLE_ADMIN, ROLE_SUPER_ADMIN]))]
     cat_map = {'spam': '垃圾信息', 'abuse': '骚扰/辱骂', 'fake': '虚假信息', 'other': '其他'}
     sev_map = {'low': '低', 'medium': '中', 'high': '高'}
-    for admin in admins:
-        try:
-            create_notification(
-                admin.id,
-                '新的举报',
-                f"有新的举报需要处理（类别：{cat_map.get(report.category, report.category)}，严重级：{sev_map.get(report.severity, report.severity)}）",
-                'warning',
-                report.item_id
-            )
-        except:
-            pass
+    notify_many(
+        admin_ids,
+        '新的举报',
+        f"有新的举报需要处理（类别：{cat_map.get(report.category, report.category)}，严重级：{sev_map.get(report.severity, report.severity)}）",
+        'warning',
+        report.item_id
+    )
+    db.session.commit()
     return jsonify({'message': 'reported', 'id': report.id}), 201
 
 
@@ -1127,35 +2996,97 @@ def upload_avatar():
             except:
                 pass
         user.avatar_path = filename
+        # 评论中展示头像，需使该用户评论过的物品的评论 ETag 失效
+        commented_item_ids = db.session.query(Comment.item_id).filter_by(user_id=user.id).distinct()
+        for (commented_item_id,) in commented_item_ids:
+            bump_comments_generation(commented_item_id)
         db.session.commit()
         return jsonify(user.to_dict())
     return jsonify({'message': '不支持的图片格式'}), 400
 
 
-# 物品相关路由
-@app.route('/api/items', methods=['GET'])
-def get_items():
-    category = request.args.get('category', '')
-    item_type = request.args.get('item_type', '')
-    status = request.args.get('status', 'open')
-    search = request.args.get('search', '')
-    # 分页参数
+# 游标分页：按 (created_at, id) 倒序做 keyset 分页，游标为不透明的 base64 字符串，
+# 不做 OFFSET 扫描，也不计算精确总数
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise InvalidCursor(cursor)
+
+def parse_page_arg(value, default, maximum=None):
+    """解析分页参数：非整数回退默认值，结果至少为 1，可选上限"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        value = default
+    value = max(value, 1)
+    return min(value, maximum) if maximum else value
+
+def keyset_paginate(query, created_col, id_col, cursor, page_size):
+    """返回 (rows, next_cursor)；cursor 为空表示第一页，next_cursor 为 None 表示没有更多"""
+    page_size = max(page_size, 1)
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor)
+        query = query.filter(
+            (created_col < cursor_created_at) |
+            ((created_col == cursor_created_at) & (id_col < cursor_id))
+        )
+    rows = query.order_by(created_col.desc(), id_col.desc()).limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    next_cursor = None
+    if has_more:
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return rows, next_cursor
+
+def cursor_page_payload(items, next_cursor, page_size):
+    return {
+        'items': items,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
+        'page_size': page_size
+    }
+
+def cursor_page_response(items, next_cursor, page_size):
+    return jsonify(cursor_page_payload(items, next_cursor, page_size))
+
+def normalize_items_args(args):
+    """规范化物品列表查询参数，结果同时用作响应缓存键"""
     try:
-        page = int(request.args.get('page', 1))
+        page = int(args.get('page', 1))
     except:
         page = 1
     try:
-        page_size = int(request.args.get('page_size', 12))
+        page_size = int(args.get('page_size', 12))
     except:
         page_size = 12
-    page = 1 if page < 1 else page
-    page_size = 1 if page_size < 1 else min(page_size, 50)
-    # 日期范围
-    start_date = request.args.get('start_date', None)
-    end_date = request.args.get('end_date', None)
-    
+    return {
+        'category': args.get('category', ''),
+        'item_type': args.get('item_type', ''),
+        'status': args.get('status', 'open'),
+        'search': (args.get('search', '') or '').strip(),
+        'page': 1 if page < 1 else page,
+        'page_size': 1 if page_size < 1 else min(page_size, 50),
+        'start_date': args.get('start_date') or '',
+        'end_date': args.get('end_date') or '',
+        'cursor': args.get('cursor'),  # None 表示偏移分页
+    }
+
+def filtered_items_query(category='', item_type='', status='', search='', start_date='', end_date=''):
+    """按列表筛选条件构造物品查询，返回 (query, order_by)"""
     query = Item.query
-    
+    order_by = [Item.created_at.desc()]
+
     if category:
         query = query.filter_by(category=category)
     if item_type:
@@ -1163,51 +3094,141 @@ def get_items():
     if status:
         query = query.filter_by(status=status)
     if search:
-        query = query.filter(
-            (Item.title.contains(search)) | 
-            (Item.description.contains(search))
-        )
-    
-    # 日期范围过滤（Item.date 为字符串，尝试解析为日期）
+        match_query = build_search_match_query(search) if SEARCH_FTS_ENABLED else ''
+        if match_query:
+            # 命中全文索引，按相关度（bm25）排序，相同相关度按发布时间倒序
+            search_hits = search_hits_subquery(match_query)
+            query = query.join(search_hits, search_hits.c.item_id == Item.id)
+            order_by = [search_hits.c.score.asc(), Item.created_at.desc()]
+        else:
+            query = query.filter(
+                (Item.title.contains(search)) |
+                (Item.description.contains(search))
+            )
+
+    # 日期范围过滤（基于已索引的 date_value 列，在数据库中完成筛选与分页）
     if start_date and end_date:
         try:
-            from datetime import datetime as dt
-            s = dt.strptime(start_date, '%Y-%m-%d')
-            e = dt.strptime(end_date, '%Y-%m-%d')
-            items_all = query.order_by(Item.created_at.desc()).all()
-            filtered = []
-            for it in items_all:
-                try:
-                    d = dt.strptime(it.date, '%Y-%m-%d')
-                    if s <= d <= e:
-                        filtered.append(it)
-                except:
-                    pass
-            total = len(filtered)
-            start_idx = (page - 1) * page_size
-            items_page = filtered[start_idx:start_idx + page_size]
-            return jsonify({
-                'items': [item.to_dict() for item in items_page],
-                'total': total,
-                'page': page,
-                'page_size': page_size
-            })
-        except:
+            s = datetime.strptime(start_date, '%Y-%m-%d').date()
+            e = datetime.strptime(end_date, '%Y-%m-%d').date()
+            query = query.filter(Item.date_value.between(s, e))
+        except ValueError:
             pass
+    return query, order_by
 
-    pagination = query.order_by(Item.created_at.desc()).paginate(page=page, per_page=page_size, error_out=False)
-    return jsonify({
+def build_items_listing(category, item_type, status, search, page, page_size, start_date, end_date, cursor):
+    """查询物品列表并返回响应数据；游标非法时抛出 InvalidCursor"""
+    query, order_by = filtered_items_query(category, item_type, status, search, start_date, end_date)
+    query = query.options(*item_list_options())
+
+    # 游标模式（传 cursor 参数，首页传空串）：按发布时间 keyset 分页，不返回总数
+    if cursor is not None:
+        items_page, next_cursor = keyset_paginate(query, Item.created_at, Item.id, cursor, page_size)
+        return cursor_page_payload([item.to_dict() for item in items_page], next_cursor, page_size)
+
+    pagination = query.order_by(*order_by).paginate(page=page, per_page=page_size, error_out=False)
+    return {
         'items': [item.to_dict() for item in pagination.items],
         'total': pagination.total,
         'page': page,
         'page_size': page_size
-    })
+    }
+
+# 物品相关路由
+@app.route('/api/items', methods=['GET'])
+def get_items():
+    params = normalize_items_args(request.args)
+    cache_key = (get_generation(ITEMS_GENERATION), tuple(sorted(params.items())))
+
+    def build():
+        body = items_response_cache.get(cache_key)
+        if body is None:
+            try:
+                payload = build_items_listing(**params)
+            except InvalidCursor:
+                return jsonify({'message': '无效的分页游标'}), 400
+            body = jsonify(payload).get_data()
+            items_response_cache.set(cache_key, body)
+        return app.response_class(body, mimetype='application/json')
+
+    return conditional_response(make_etag('items', *cache_key), build)
+
+
+@app.route('/api/items/facets', methods=['GET'])
+def get_item_facets():
+    """获取当前搜索/筛选条件下 category、item_type、status 的分面计数"""
+    params = normalize_items_args(request.args)
+    cache_key = ('facets', get_generation(ITEMS_GENERATION), tuple(sorted(params.items())))
+    body = items_response_cache.get(cache_key)
+    if body is None:
+        rows = item_facet_rows(params['search'], params['start_date'], params['end_date'])
+        facets = rollup_facets(rows, params['category'], params['item_type'], params['status'])
+        body = jsonify(facets).get_data()
+        items_response_cache.set(cache_key, body)
+    return app.response_class(body, mimetype='application/json')
+
+
+@app.route('/api/items/search-by-image', methods=['POST'])
+def search_items_by_image():
+    """以图搜物：上传一张照片，返回外观最相近的进行中物品（按汉明距离升序）。
+
+    表单字段 category 为搜索者自己的类别（lost 表示“我丢了东西”，在拾物中查找），
+    图片只在内存中计算哈希，不写入上传目录。
+    """
+    file = request.files.get('image')
+    if not file:
+        return jsonify({'message': '未上传图片'}), 400
+    category = request.form.get('category', 'lost')
+    if category not in ('lost', 'found'):
+        return jsonify({'message': '无效的类别'}), 400
+    original_filename = file.filename or ''
+    if original_filename and original_filename.lower() != 'blob' and not allowed_file(original_filename):
+        return jsonify({'message': '不支持的图片格式'}), 400
+    if file_too_large(file):
+        return jsonify({'message': '图片大小超过限制（最大10MB）'}), 400
+    try:
+        limit = min(max(int(request.form.get('limit', 10) or 10), 1), 50)
+    except (TypeError, ValueError):
+        limit = 10
+    try:
+        with Image.open(file.stream) as img:
+            query_hash = dhash(img)
+    except Exception as e:
+        print(f'[DEBUG] 以图搜物图片解析失败: {e}')
+        return jsonify({'message': '无法识别的图片'}), 400
+
+    opposite_category = 'found' if category == 'lost' else 'lost'
+    distances = visual_item_matches([query_hash], opposite_category)
+    ranked = heapq.nsmallest(limit + 10, distances.items(), key=lambda pair: (pair[1], -pair[0]))
+    ids = [item_id for item_id, _ in ranked]
+    items = {
+        i.id: i for i in Item.query.options(*item_list_options()).filter(
+            Item.id.in_(ids), Item.status == 'open', Item.category == opposite_category
+        )
+    } if ids else {}
+    result = []
+    for item_id, distance in ranked:
+        if item_id not in items:
+            image_hash_index.remove_item(item_id)
+            continue
+        item_dict = items[item_id].to_dict()
+        item_dict['image_distance'] = distance
+        item_dict['image_similarity'] = round(visual_similarity(distance), 4)
+        result.append(item_dict)
+    return jsonify(result[:limit])
 
 
 @app.route('/api/items/<int:item_id>', methods=['GET'])
 def get_item(item_id):
     item = Item.query.get_or_404(item_id)
-    return jsonify(item.to_dict())
+    version = item.updated_at or item.created_at
+    # 响应中的物主用户名不随物品的 updated_at 变化，单独计入 ETag
+    owner_name = item.user.username if item.user else ''
+    return conditional_response(
+        make_etag('item', item.id, version.isoformat(), owner_name),
+        lambda: jsonify(item.to_dict()),
+        last_modified=version
+    )
 
 @app.route('/api/users/<int:user_id>/items', methods=['GET'])
 def get_user_items(user_id):
@@ -1221,8 +3242,8 @@ def get_user_items(user_id):
         except:
             pass
     owner = User.query.get_or_404(user_id)
-    page = int(request.args.get('page', 1) or 1)
-    page_size = int(request.args.get('page_size', 12) or 12)
+    page = parse_page_arg(request.args.get('page'), 1)
+    page_size = parse_page_arg(request.args.get('page_size'), 12, 50)
     category = request.args.get('category', '')
     status = request.args.get('status', '')
     if owner.visibility_setting == 'hidden':
@@ -1239,11 +3260,18 @@ def get_user_items(user_id):
             allowed = owner.others_policy != 'hide'
         if not allowed:
             return jsonify({'message': '该用户设置隐藏了自己的发布失物/拾物的历史信息'}), 403
-    query = Item.query.filter_by(user_id=user_id)
+    query = Item.query.options(*item_list_options()).filter_by(user_id=user_id)
     if category:
         query = query.filter_by(category=category)
     if status:
         query = query.filter_by(status=status)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            items_page, next_cursor = keyset_paginate(query, Item.created_at, Item.id, cursor, page_size)
+        except InvalidCursor:
+            return jsonify({'message': '无效的分页游标'}), 400
+        return cursor_page_response([item.to_dict() for item in items_page], next_cursor, page_size)
     pagination = query.order_by(Item.created_at.desc()).paginate(page=page, per_page=page_size, error_out=False)
     return jsonify({
         'items': [item.to_dict() for item in pagination.items],
@@ -1256,13 +3284,31 @@ def get_user_items(user_id):
 @app.route('/api/items/<int:item_id>/timeline', methods=['GET'])
 def get_item_timeline(item_id):
     item = Item.query.get_or_404(item_id)
+    # 时间线只会追加通知、因删除而缩短，或合并通知原地累加 count / 刷新 last_time，
+    # (数量, 最大id, 合并总次数, 最新时间) 足以标识其版本
+    noti_count, noti_max_id, noti_total, noti_latest = db.session.query(
+        db.func.count(Notification.id),
+        db.func.max(Notification.id),
+        db.func.sum(db.func.coalesce(Notification.count, 1)),
+        db.func.max(db.func.coalesce(Notification.last_time, Notification.created_at))
+    ).filter(Notification.related_item_id == item_id).one()
+    item_version = item.updated_at or item.created_at
+    version = max(item_version, noti_latest) if noti_latest else item_version
+    etag = make_etag('timeline', item.id, item_version.isoformat(), noti_count, noti_max_id, noti_total, noti_latest)
+    return conditional_response(etag, lambda: build_item_timeline(item), last_modified=version)
+
+
+def build_item_timeline(item):
+    item_id = item.id
     events = [{
         'time': item.created_at.strftime('%Y-%m-%d %H:%M:%S'),
         'title': '发布',
         'description': f'用户 {item.user.username if item.user else ""} 发布了《{item.title}》'
     }]
-    notis = Notification.query.filter_by(related_item_id=item_id).order_by(Notification.created_at.asc()).all()
-    for n in notis:
+    # 已归档的通知同样属于时间线
+    archived = NotificationArchive.query.filter_by(related_item_id=item_id).all()
+    notis = Notification.query.filter_by(related_item_id=item_id).all()
+    for n in sorted(archived + notis, key=lambda n: n.created_at):
         events.append({
             'time': n.created_at.strftime('%Y-%m-%d %H:%M:%S'),
             'title': n.title,
@@ -1367,14 +3413,8 @@ def create_item():
         image_paths.append(filename)
         print(f'[DEBUG] 副图已保存: {filename}')
     
-    # 保存图片路径（JSON格式）
-    images_path_json = json.dumps(image_paths) if image_paths else None
-    # 向后兼容：保存第一张作为主图
-    image_path = image_paths[0] if image_paths else None
-    
     print(f'[DEBUG] 上传的图片数量: {len(image_paths)}')
     print(f'[DEBUG] 图片路径列表: {image_paths}')
-    print(f'[DEBUG] images_path_json: {images_path_json}')
     
     new_item = Item(
         title=data['title'],
@@ -1385,16 +3425,18 @@ def create_item():
         contact_name=data['contact_name'],
         contact_phone=data['contact_phone'],
         date=data['date'],
-        image_path=image_path,  # 向后兼容
-        images_path=images_path_json,  # 多张图片
+        images=build_item_images(image_paths),
         user_id=user_id
     )
     
     db.session.add(new_item)
+    db.session.flush()
+    index_item_for_search(new_item)
+    index_item_for_matching(new_item)
+    bump_items_generation()
     db.session.commit()
     
     # 验证保存的数据
-    print(f'[DEBUG] 保存后的 images_path: {new_item.images_path}')
     item_dict = new_item.to_dict()
     print(f'[DEBUG] 返回的 image_urls: {item_dict.get("image_urls", [])}')
     
@@ -1407,6 +3449,8 @@ def create_item():
         'success',
         new_item.id
     )
+    schedule_item_matches(new_item.id)
+    schedule_saved_search_percolation(new_item.id)
     
     return jsonify(item_dict), 201
 
@@ -1436,6 +3480,9 @@ def update_item(item_id):
     item.date = data.get('date', item.date)
     old_status = item.status
     item.status = data.get('status', item.status)
+    index_item_for_search(item)
+    index_item_for_matching(item)
+    bump_items_generation()
     
     db.session.commit()
     
@@ -1448,6 +3495,7 @@ def update_item(item_id):
             'success',
             item.id
         )
+    schedule_item_matches(item.id)
     
     return jsonify(item.to_dict())
 
@@ -1517,29 +3565,12 @@ def update_item_image(item_id):
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
     file.save(filepath)
     
-    # 删除旧图片（包括单图和多图中的旧图片）
-    old_paths_to_delete = []
-    if item.image_path:
-        old_paths_to_delete.append(item.image_path)
-    if item.images_path:
-        try:
-            old_paths = json.loads(item.images_path)
-            if isinstance(old_paths, list):
-                old_paths_to_delete.extend(old_paths)
-        except:
-            pass
-    
-    for old_path in old_paths_to_delete:
-        try:
-            old_filepath = os.path.join(app.config['UPLOAD_FOLDER'], old_path)
-            if os.path.exists(old_filepath):
-                os.remove(old_filepath)
-        except Exception as e:
-            print(f'[DEBUG] 删除旧图片失败: {old_path}, 错误: {e}')
+    # 删除旧图片
+    remove_upload_files([image.path for image in item.images if image.path != filename])
     
-    # 更新图片路径（单图和多图都更新为新的单张图片）
-    item.image_path = filename
-    item.images_path = json.dumps([filename])  # 更新为只包含新图片的数组
+    # 更新为只包含新图片
+    set_item_images(item, [filename])
+    bump_items_generation()
     db.session.commit()
     
     # 验证保存的数据
@@ -1672,37 +3703,12 @@ def update_item_images(item_id):
     final_image_paths.extend(image_paths)
     
     # 删除不再使用的旧图片
-    old_paths_to_delete = []
-    if item.image_path:
-        if item.image_path not in final_image_paths:
-            old_paths_to_delete.append(item.image_path)
-    if item.images_path:
-        try:
-            old_paths = json.loads(item.images_path)
-            if isinstance(old_paths, list):
-                for old_path in old_paths:
-                    if old_path not in final_image_paths:
-                        old_paths_to_delete.append(old_path)
-        except:
-            pass
-    
-    for old_path in old_paths_to_delete:
-        try:
-            old_filepath = os.path.join(app.config['UPLOAD_FOLDER'], old_path)
-            if os.path.exists(old_filepath):
-                os.remove(old_filepath)
-        except Exception as e:
-            print(f'[DEBUG] 删除旧图片失败: {old_path}, 错误: {e}')
+    remove_upload_files([image.path for image in item.images if image.path not in final_image_paths])
     
-    # 更新数据库
-    if final_image_paths:
-        item.images_path = json.dumps(final_image_paths)
-        item.image_path = final_image_paths[0]  # 第一张作为主图（向后兼容）
-        print(f'[DEBUG] 更新后的图片路径（按顺序）: {final_image_paths}')
-    else:
-        item.images_path = None
-        item.image_path = None
-        print(f'[DEBUG] 清空所有图片')
+    # 更新数据库（第一张作为主图）
+    set_item_images(item, final_image_paths)
+    print(f'[DEBUG] 更新后的图片路径（按顺序）: {final_image_paths}')
+    bump_items_generation()
     
     db.session.commit()
     
@@ -1728,13 +3734,9 @@ def delete_item_image(item_id):
     item = Item.query.get_or_404(item_id)
     if item.user_id != user_id:
         return jsonify({'message': '无权限操作'}), 403
-    if item.image_path:
-        try:
-            os.remove(os.path.join(app.config['UPLOAD_FOLDER'], item.image_path))
-        except:
-            pass
-    item.image_path = None
-    item.images_path = None
+    remove_upload_files([image.path for image in item.images])
+    set_item_images(item, [])
+    bump_items_generation()
     db.session.commit()
     return jsonify(item.to_dict())
 
@@ -1758,30 +3760,18 @@ def delete_item(item_id):
         if comment_ids:
             CommentLike.query.filter(CommentLike.comment_id.in_(comment_ids)).delete(synchronize_session=False)
         Comment.query.filter_by(item_id=item_id).delete(synchronize_session=False)
+        bump_comments_generation(item_id)
         Favorite.query.filter_by(item_id=item_id).delete(synchronize_session=False)
         Claim.query.filter_by(item_id=item_id).delete(synchronize_session=False)
         Report.query.filter_by(item_id=item_id).update({'item_id': None}, synchronize_session=False)
         Notification.query.filter_by(related_item_id=item_id).update({'related_item_id': None}, synchronize_session=False)
+        NotificationArchive.query.filter_by(related_item_id=item_id).update({'related_item_id': None}, synchronize_session=False)
         
-        # 删除图片文件（主图 + 多图）
-        if item.image_path:
-            try:
-                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], item.image_path))
-            except Exception:
-                pass
-        if item.images_path:
-            try:
-                image_paths = json.loads(item.images_path)
-                if isinstance(image_paths, list):
-                    for path in image_paths:
-                        if path:
-                            try:
-                                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], path))
-                            except Exception:
-                                pass
-            except Exception:
-                pass
+        # 删除图片文件（图片记录随物品级联删除）
+        remove_upload_files([image.path for image in item.images])
         
+        remove_item_from_search(item.id)
+        bump_items_generation()
         db.session.delete(item)
         db.session.commit()
         return jsonify({'message': '删除成功'})
@@ -1847,20 +3837,48 @@ def get_avatar(filename):
 
 
 # 通知相关路由
+# 旧版（不分页）通知列表的最大返回条数
+NOTIFICATION_LEGACY_LIMIT = 200
+
 @app.route('/api/notifications', methods=['GET'])
 @jwt_required()
 def get_notifications():
+    """通知列表。传 cursor（首页传空串）时按 (created_at, id) 游标分页；
+    is_read=true/false 按已读状态筛选；archived=true 查看已归档的通知。
+    不传 cursor 时为旧版接口：响应体仍为数组，只返回最近 NOTIFICATION_LEGACY_LIMIT 条；
+    被截断时带 X-Has-More: true 与 X-Next-Cursor 响应头，可用该游标继续分页读取其余通知"""
     user_id = int(get_jwt_identity())
-    notifications = Notification.query.filter_by(user_id=user_id).order_by(Notification.created_at.desc()).all()
-    return jsonify([n.to_dict() for n in notifications])
+    archived = request.args.get('archived', '').lower() in ('true', '1', 'yes')
+    model = NotificationArchive if archived else Notification
+    query = model.query.filter_by(user_id=user_id)
+    is_read = request.args.get('is_read', '').lower()
+    if is_read in ('true', '1', 'yes'):
+        query = query.filter(model.is_read == True)
+    elif is_read in ('false', '0', 'no'):
+        query = query.filter(model.is_read == False)
+
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        page_size = parse_page_arg(request.args.get('page_size'), 20, 100)
+        try:
+            notifications, next_cursor = keyset_paginate(query, model.created_at, model.id, cursor, page_size)
+        except InvalidCursor:
+            return jsonify({'message': '无效的分页游标'}), 400
+        return cursor_page_response([n.to_dict() for n in notifications], next_cursor, page_size)
+
+    notifications, next_cursor = keyset_paginate(query, model.created_at, model.id, None, NOTIFICATION_LEGACY_LIMIT)
+    response = jsonify([n.to_dict() for n in notifications])
+    response.headers['X-Has-More'] = 'true' if next_cursor else 'false'
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 
 @app.route('/api/notifications/unread-count', methods=['GET'])
 @jwt_required()
 def get_unread_count():
     user_id = int(get_jwt_identity())
-    count = Notification.query.filter_by(user_id=user_id, is_read=False).count()
-    return jsonify({'count': count})
+    return jsonify({'count': unread_counts(user_id)['notifications']})
 
 
 @app.route('/api/notifications/<int:notification_id>/read', methods=['PUT'])
@@ -1872,7 +3890,9 @@ def mark_notification_read(notification_id):
     if notification.user_id != user_id:
         return jsonify({'message': '无权限操作'}), 403
     
-    notification.is_read = True
+    if not notification.is_read:
+        notification.is_read = True
+        adjust_unread_counters(user_id, notifications=-1)
     db.session.commit()
     
     return jsonify(notification.to_dict())
@@ -1882,7 +3902,8 @@ def mark_notification_read(notification_id):
 @jwt_required()
 def mark_all_read():
     user_id = int(get_jwt_identity())
-    Notification.query.filter_by(user_id=user_id, is_read=False).update({'is_read': True})
+    updated = Notification.query.filter_by(user_id=user_id, is_read=False).update({'is_read': True})
+    adjust_unread_counters(user_id, notifications=-updated)
     db.session.commit()
     return jsonify({'message': '所有通知已标记为已读'})
 
@@ -1890,9 +3911,10 @@ def mark_all_read():
 # 统计相关
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
-    total_lost = Item.query.filter_by(category='lost').count()
-    total_found = Item.query.filter_by(category='found').count()
-    total_solved = Item.query.filter_by(status='closed').count()
+    facets = rollup_facets(item_facet_rows())
+    total_lost = facets['category'].get('lost', 0)
+    total_found = facets['category'].get('found', 0)
+    total_solved = facets['status'].get('closed', 0)
     total_users = User.query.count()
     
     return jsonify({
@@ -2034,7 +4056,7 @@ def admin_user_ban(user_id):
 def admin_items():
     if not admin_required():
         return jsonify({'message': 'forbidden'}), 403
-    items = Item.query.order_by(Item.created_at.desc()).all()
+    items = Item.query.options(*item_list_options()).order_by(Item.created_at.desc()).all()
     return jsonify([i.to_dict() for i in items])
 
 @app.route('/api/admin/items/<int:item_id>/status', methods=['PUT'])
@@ -2046,6 +4068,7 @@ def admin_item_status(item_id):
     item = Item.query.get_or_404(item_id)
     data = request.json
     item.status = data.get('status', item.status)
+    bump_items_generation()
     db.session.commit()
     return jsonify(item.to_dict())
 
@@ -2325,15 +4348,312 @@ def update_report_by_user(report_id):
 def admin_stats():
     if not admin_required():
         return jsonify({'message': 'forbidden'}), 403
+    facets = rollup_facets(item_facet_rows())
     return jsonify({
         'users': User.query.count(),
-        'items': Item.query.count(),
-        'lost': Item.query.filter_by(category='lost').count(),
-        'found': Item.query.filter_by(category='found').count(),
-        'closed': Item.query.filter_by(status='closed').count(),
+        'items': facets['total'],
+        'lost': facets['category'].get('lost', 0),
+        'found': facets['category'].get('found', 0),
+        'closed': facets['status'].get('closed', 0),
         'reports_open': Report.query.filter_by(status='open').count()
     })
 
+# ==================== 敏感词库管理 ====================
+
+@app.route('/api/admin/unread-counters/reconcile', methods=['POST'])
+@jwt_required()
+def admin_reconcile_unread_counters():
+    """立即按实际数据校正全部用户的未读计数"""
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    fixed = reconcile_unread_counters()
+    return jsonify({'message': '未读计数已校正', 'fixed': fixed})
+
+@app.route('/api/admin/notifications/archive', methods=['POST'])
+@jwt_required()
+def admin_archive_notifications():
+    """立即归档保留期外的已读通知（可传 retention_days 覆盖配置）"""
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    data = request.json or {}
+    try:
+        retention_days = int(data['retention_days']) if 'retention_days' in data else None
+    except (TypeError, ValueError):
+        return jsonify({'message': '参数不完整'}), 400
+    if retention_days is not None and retention_days <= 0:
+        return jsonify({'message': '保留天数必须大于 0'}), 400
+    archived = archive_read_notifications(retention_days)
+    return jsonify({'message': '归档完成', 'archived': archived})
+
+@app.route('/api/admin/sensitive-words', methods=['GET'])
+@jwt_required()
+def admin_sensitive_words():
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    kind = request.args.get('kind', '')
+    query = SensitiveTerm.query
+    if kind:
+        query = query.filter_by(kind=kind)
+    terms = query.order_by(SensitiveTerm.id.asc()).all()
+    return jsonify({
+        'version': get_generation(SENSITIVE_WORDS_GENERATION),
+        'terms': [t.to_dict() for t in terms]
+    })
+
+@app.route('/api/admin/sensitive-words', methods=['POST'])
+@jwt_required()
+def admin_add_sensitive_words():
+    """添加敏感词/安全词，支持 term 单个或 terms 列表"""
+    current_admin = get_current_user()
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    data = request.json or {}
+    kind = data.get('kind', SENSITIVE_TERM_WORD)
+    if kind not in (SENSITIVE_TERM_WORD, SENSITIVE_TERM_SAFE):
+        return jsonify({'message': '无效的词类型'}), 400
+    raw_terms = data.get('terms') if isinstance(data.get('terms'), list) else [data.get('term')]
+    terms = list(dict.fromkeys(str(t).strip() for t in raw_terms if t and str(t).strip()))
+    if not terms:
+        return jsonify({'message': '词条不能为空'}), 400
+    if any(len(t) > 100 for t in terms):
+        return jsonify({'message': '词条长度不能超过100'}), 400
+    existing = {t.term for t in SensitiveTerm.query.filter(SensitiveTerm.kind == kind, SensitiveTerm.term.in_(terms))}
+    added = [SensitiveTerm(term=t, kind=kind, created_by=current_admin.id) for t in terms if t not in existing]
+    scan = None
+    if added:
+        db.session.add_all(added)
+        bump_generation(SENSITIVE_WORDS_GENERATION)
+        db.session.commit()
+        # 新增敏感词后在后台回扫历史内容（只检测新增的词）
+        if kind == SENSITIVE_TERM_WORD:
+            scan = create_moderation_scan([t.term for t in added], current_admin.id)
+            start_moderation_scan(scan.id)
+    return jsonify({
+        'version': get_generation(SENSITIVE_WORDS_GENERATION),
+        'added': [t.to_dict() for t in added],
+        'skipped': sorted(existing),
+        'scan': scan.to_dict() if scan else None
+    }), 201
+
+@app.route('/api/admin/sensitive-words/<int:term_id>', methods=['DELETE'])
+@jwt_required()
+def admin_delete_sensitive_word(term_id):
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    term = SensitiveTerm.query.get_or_404(term_id)
+    db.session.delete(term)
+    bump_generation(SENSITIVE_WORDS_GENERATION)
+    db.session.commit()
+    return jsonify({'message': 'deleted', 'version': get_generation(SENSITIVE_WORDS_GENERATION)})
+
+# ==================== 敏感词回扫与审核队列 ====================
+# 后台任务按 id 顺序分批遍历物品、评论、认领和聊天消息，在后台线程内用任务专属的匹配器匹配；
+# 每批的命中记录与断点在同一事务中提交，中断后从断点继续不会重复入队
+MODERATION_SOURCES = ('item', 'comment', 'claim', 'message')
+
+def moderation_source_query(source):
+    """返回 (模型, 查询)，查询列依次为 id、作者 id 和待检测的文本字段"""
+    if source == 'item':
+        return Item, db.session.query(Item.id, Item.user_id, Item.title, Item.description)
+    if source == 'comment':
+        return Comment, db.session.query(Comment.id, Comment.user_id, Comment.content)\
+            .filter(Comment.is_deleted == False)
+    if source == 'claim':
+        return Claim, db.session.query(Claim.id, Claim.claimant_id, Claim.description)
+    return Message, db.session.query(Message.id, Message.sender_id, Message.content)\
+        .filter(Message.is_recalled == False)
+
+def _moderation_excerpt(text, word):
+    pos = text.lower().find(word.lower())
+    start = max(pos - 40, 0)
+    return text[start:start + 200]
+
+def create_moderation_scan(terms=None, created_by=None):
+    """创建回扫任务；terms 为空时使用完整词库"""
+    total = sum(moderation_source_query(source)[1].count() for source in MODERATION_SOURCES)
+    scan = ModerationScan(
+        terms=json.dumps(terms, ensure_ascii=False) if terms else None,
+        dictionary_version=get_generation(SENSITIVE_WORDS_GENERATION),
+        total=total,
+        created_by=created_by
+    )
+    db.session.add(scan)
+    db.session.commit()
+    return scan
+
+def start_moderation_scan(scan_id):
+    """原子地把任务置为 running 并启动后台执行；任务正在其他进程中运行（心跳未超时）时返回 False"""
+    stale_before = datetime.now() - timedelta(seconds=app.config['MODERATION_SCAN_STALE_SECONDS'])
+    claimed = ModerationScan.query.filter(
+        ModerationScan.id == scan_id,
+        ModerationScan.status.in_(('pending', 'failed', 'cancelled')) |
+        ((ModerationScan.status == 'running') & (ModerationScan.updated_at < stale_before))
+    ).update({'status': 'running', 'error': None, 'updated_at': datetime.now()}, synchronize_session=False)
+    db.session.commit()
+    if not claimed:
+        return False
+    socketio.start_background_task(run_moderation_scan, scan_id)
+    return True
+
+def run_moderation_scan(scan_id):
+    with app.app_context():
+        scan = ModerationScan.query.get(scan_id)
+        current = get_sensitive_word_matcher()
+        words = json.loads(scan.terms) if scan.terms else current.sensitive_words
+        chunk_size = app.config['MODERATION_SCAN_CHUNK_SIZE']
+        matcher = SensitiveWordMatcher(words, current.safe_phrases)
+        print(f'[MODERATION] 回扫任务 {scan_id} 开始：{len(words)} 个敏感词，断点 {scan.source}#{scan.last_id}')
+        try:
+            start = MODERATION_SOURCES.index(scan.source) if scan.source in MODERATION_SOURCES else 0
+            for source in MODERATION_SOURCES[start:]:
+                if scan.source != source:
+                    scan.source = source
+                    scan.last_id = 0
+                    db.session.commit()
+                model, query = moderation_source_query(source)
+                while True:
+                    status = db.session.query(ModerationScan.status).filter_by(id=scan_id).scalar()
+                    if status != 'running':
+                        print(f'[MODERATION] 回扫任务 {scan_id} 已停止：{status}')
+                        return
+                    rows = query.filter(model.id > scan.last_id).order_by(model.id.asc()).limit(chunk_size).all()
+                    if not rows:
+                        break
+                    texts = [(row[0], ' '.join(t for t in row[2:] if t)) for row in rows]
+                    authors = {row[0]: row[1] for row in rows}
+                    hits = [(row_id, matcher.find(text)[1]) for row_id, text in texts]
+                    hits = [(row_id, found) for row_id, found in hits if found]
+                    text_by_id = dict(texts)
+                    for row_id, found_words in hits:
+                        db.session.add(ModerationFlag(
+                            scan_id=scan_id,
+                            source_type=source,
+                            source_id=row_id,
+                            user_id=authors.get(row_id),
+                            matched_words=json.dumps(found_words, ensure_ascii=False),
+                            excerpt=_moderation_excerpt(text_by_id[row_id], found_words[0])
+                        ))
+                    scan.last_id = rows[-1][0]
+                    scan.scanned = (scan.scanned or 0) + len(rows)
+                    scan.flagged = (scan.flagged or 0) + len(hits)
+                    db.session.commit()
+            # 只结束仍为 running 的任务，不覆盖最后一批之后管理员发出的取消
+            finished = ModerationScan.query.filter_by(id=scan_id, status='running').update(
+                {'status': 'completed', 'finished_at': datetime.now()}, synchronize_session=False
+            )
+            db.session.commit()
+            if finished:
+                print(f'[MODERATION] 回扫任务 {scan_id} 完成：扫描 {scan.scanned} 条，命中 {scan.flagged} 条')
+            else:
+                print(f'[MODERATION] 回扫任务 {scan_id} 已停止：结束前状态已被修改')
+        except Exception as e:
+            db.session.rollback()
+            ModerationScan.query.filter_by(id=scan_id, status='running').update(
+                {'status': 'failed', 'error': str(e)}, synchronize_session=False
+            )
+            db.session.commit()
+            print(f'[ERROR] 回扫任务 {scan_id} 失败: {e}')
+
+@app.route('/api/admin/moderation/scans', methods=['GET'])
+@jwt_required()
+def admin_moderation_scans():
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    scans = ModerationScan.query.order_by(ModerationScan.id.desc()).limit(50).all()
+    return jsonify([scan.to_dict() for scan in scans])
+
+@app.route('/api/admin/moderation/scans', methods=['POST'])
+@jwt_required()
+def admin_create_moderation_scan():
+    """手动发起回扫；可传 terms 指定敏感词，否则使用完整词库"""
+    current_admin = get_current_user()
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    data = request.get_json(silent=True) or {}
+    terms = data.get('terms')
+    if terms is not None:
+        if not isinstance(terms, list):
+            return jsonify({'message': '参数不完整'}), 400
+        terms = [str(t).strip() for t in terms if t and str(t).strip()] or None
+    scan = create_moderation_scan(terms, current_admin.id)
+    start_moderation_scan(scan.id)
+    return jsonify(scan.to_dict()), 201
+
+@app.route('/api/admin/moderation/scans/<int:scan_id>', methods=['GET'])
+@jwt_required()
+def admin_moderation_scan(scan_id):
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    return jsonify(ModerationScan.query.get_or_404(scan_id).to_dict())
+
+@app.route('/api/admin/moderation/scans/<int:scan_id>/resume', methods=['POST'])
+@jwt_required()
+def admin_resume_moderation_scan(scan_id):
+    """从断点继续失败、已取消或心跳超时的任务"""
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    scan = ModerationScan.query.get_or_404(scan_id)
+    if scan.status == 'completed':
+        return jsonify({'message': '任务已完成'}), 400
+    if not start_moderation_scan(scan_id):
+        return jsonify({'message': '任务正在运行'}), 409
+    db.session.refresh(scan)
+    return jsonify(scan.to_dict())
+
+@app.route('/api/admin/moderation/scans/<int:scan_id>/cancel', methods=['POST'])
+@jwt_required()
+def admin_cancel_moderation_scan(scan_id):
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    scan = ModerationScan.query.get_or_404(scan_id)
+    if scan.status not in ('pending', 'running'):
+        return jsonify({'message': '任务未在运行'}), 400
+    scan.status = 'cancelled'
+    db.session.commit()
+    return jsonify(scan.to_dict())
+
+@app.route('/api/admin/moderation/flags', methods=['GET'])
+@jwt_required()
+def admin_moderation_flags():
+    """分页查看审核队列（游标分页，按时间倒序）"""
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    page_size = parse_page_arg(request.args.get('page_size'), 20, 100)
+    status = request.args.get('status', 'pending')
+    source_type = request.args.get('source_type', '')
+    scan_id = request.args.get('scan_id', type=int)
+    query = ModerationFlag.query
+    if status:
+        query = query.filter_by(status=status)
+    if source_type:
+        query = query.filter_by(source_type=source_type)
+    if scan_id:
+        query = query.filter_by(scan_id=scan_id)
+    try:
+        flags, next_cursor = keyset_paginate(
+            query, ModerationFlag.created_at, ModerationFlag.id, request.args.get('cursor'), page_size
+        )
+    except InvalidCursor:
+        return jsonify({'message': '无效的分页游标'}), 400
+    return cursor_page_response([flag.to_dict() for flag in flags], next_cursor, page_size)
+
+@app.route('/api/admin/moderation/flags/<int:flag_id>', methods=['PUT'])
+@jwt_required()
+def admin_review_moderation_flag(flag_id):
+    """处理审核队列条目：resolved=已处理，dismissed=误报忽略"""
+    current_admin = get_current_user()
+    if not admin_required():
+        return jsonify({'message': 'forbidden'}), 403
+    flag = ModerationFlag.query.get_or_404(flag_id)
+    status = (request.json or {}).get('status')
+    if status not in ('pending', 'resolved', 'dismissed'):
+        return jsonify({'message': '无效的状态'}), 400
+    flag.status = status
+    flag.reviewed_by = current_admin.id if status != 'pending' else None
+    flag.reviewed_at = datetime.now() if status != 'pending' else None
+    db.session.commit()
+    return jsonify(flag.to_dict())
+
 @app.route('/api/admin-application', methods=['POST'])
 @jwt_required()
 def submit_admin_application():
@@ -2355,16 +4675,13 @@ def submit_admin_application():
         return jsonify({'message': '申请理由至少 20 字'}), 400
     application = AdminApplication(user_id=user.id, reason=reason, status='pending')
     db.session.add(application)
+    notify_many(
+        [row[0] for row in db.session.query(User.id).filter_by(role=ROLE_SUPER_ADMIN)],
+        '新的管理员申请',
+        f'{user.username} 提交了管理员申请，请前往管理员后台审核。',
+        'warning'
+    )
     db.session.commit()
-
-    super_admins = User.query.filter_by(role=ROLE_SUPER_ADMIN).all()
-    for admin in super_admins:
-        create_notification(
-            admin.id,
-            '新的管理员申请',
-            f'{user.username} 提交了管理员申请，请前往管理员后台审核。',
-            'warning'
-        )
     return jsonify(application.to_dict()), 201
 
 @app.route('/api/admin-application/my', methods=['GET'])
@@ -2498,17 +4815,31 @@ def admin_delete_user(user_id):
         # 删除用户的物品及图片
         items = Item.query.filter_by(user_id=target.id).all()
         for it in items:
-            if it.image_path:
-                try:
-                    os.remove(os.path.join(app.config['UPLOAD_FOLDER'], it.image_path))
-                except:
-                    pass
+            remove_upload_files([image.path for image in it.images])
+            remove_item_from_search(it.id)
             db.session.delete(it)
 
         # 删除通知
         Notification.query.filter_by(user_id=target.id).delete()
+        NotificationArchive.query.filter_by(user_id=target.id).delete()
         AdminApplication.query.filter_by(user_id=target.id).delete()
 
+        # 删除订阅搜索及其倒排词元
+        saved_ids = [row[0] for row in db.session.query(SavedSearch.id).filter_by(user_id=target.id)]
+        if saved_ids:
+            SavedSearchTerm.query.filter(SavedSearchTerm.saved_search_id.in_(saved_ids)).delete(synchronize_session=False)
+            SavedSearch.query.filter(SavedSearch.id.in_(saved_ids)).delete(synchronize_session=False)
+
+        # 该用户发出的未读消息将随会话删除，先扣减接收者的未读计数
+        unread_sent = db.session.query(Message.receiver_id, db.func.count()).filter(
+            Message.sender_id == target.id,
+            Message.is_read == False,
+            Message.is_deleted_by_receiver == False
+        ).group_by(Message.receiver_id).all()
+        for receiver_id, count in unread_sent:
+            adjust_unread_counters(receiver_id, messages=-count)
+        UserCounter.query.filter_by(user_id=target.id).delete()
+
         # 删除会话及其消息（对话设置了 cascade）
         conversations = Conversation.query.filter(
             (Conversation.user1_id == target.id) | (Conversation.user2_id == target.id)
@@ -2527,6 +4858,7 @@ def admin_delete_user(user_id):
         ).delete()
 
         # 最后删除用户
+        bump_items_generation()
         db.session.delete(target)
         db.session.commit()
         return jsonify({'message': 'deleted'})
@@ -2560,7 +4892,13 @@ def admin_create_item():
         user_id=uid
     )
     db.session.add(item)
+    db.session.flush()
+    index_item_for_search(item)
+    index_item_for_matching(item)
+    bump_items_generation()
     db.session.commit()
+    schedule_item_matches(item.id)
+    schedule_saved_search_percolation(item.id)
     return jsonify(item.to_dict()), 201
 
 @app.route('/api/admin/items/<int:item_id>', methods=['DELETE'])
@@ -2579,27 +4917,15 @@ def admin_delete_item(item_id):
         if comment_ids:
             CommentLike.query.filter(CommentLike.comment_id.in_(comment_ids)).delete(synchronize_session=False)
         Comment.query.filter_by(item_id=item_id).delete(synchronize_session=False)
+        bump_comments_generation(item_id)
         Favorite.query.filter_by(item_id=item_id).delete(synchronize_session=False)
         Claim.query.filter_by(item_id=item_id).delete(synchronize_session=False)
         Report.query.filter_by(item_id=item_id).update({'item_id': None}, synchronize_session=False)
         Notification.query.filter_by(related_item_id=item_id).update({'related_item_id': None}, synchronize_session=False)
-        if item.image_path:
-            try:
-                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], item.image_path))
-            except Exception:
-                pass
-        if item.images_path:
-            try:
-                image_paths = json.loads(item.images_path)
-                if isinstance(image_paths, list):
-                    for path in image_paths:
-                        if path:
-                            try:
-                                os.remove(os.path.join(app.config['UPLOAD_FOLDER'], path))
-                            except Exception:
-                                pass
-            except Exception:
-                pass
+        NotificationArchive.query.filter_by(related_item_id=item_id).update({'related_item_id': None}, synchronize_session=False)
+        remove_upload_files([image.path for image in item.images])
+        remove_item_from_search(item.id)
+        bump_items_generation()
         db.session.delete(item)
         db.session.commit()
         try:
@@ -2711,7 +5037,9 @@ def add_favorite(item_id):
             '物品被收藏',
             f'你的{item.category == "lost" and "失物" or "拾物"}《{item.title}》被收藏了',
             'info',
-            item_id
+            item_id,
+            coalesce_key=f'favorite:{item_id}',
+            coalesced_content=f'你的{item.category == "lost" and "失物" or "拾物"}《{item.title}》被收藏了 {{count}} 次'
         )
     
     return jsonify({'message': '收藏成功', 'favorite': favorite.to_dict()}), 201
@@ -2745,10 +5073,21 @@ def get_favorite_status(item_id):
 def get_my_favorites():
     """获取我的收藏列表"""
     user_id = int(get_jwt_identity())
-    page = int(request.args.get('page', 1) or 1)
-    page_size = int(request.args.get('page_size', 12) or 12)
+    page = parse_page_arg(request.args.get('page'), 1)
+    page_size = parse_page_arg(request.args.get('page_size'), 12, 50)
+    
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        try:
+            favs, next_cursor = keyset_paginate(
+                Favorite.query.options(*favorite_list_options()).filter_by(user_id=user_id),
+                Favorite.created_at, Favorite.id, cursor, page_size
+            )
+        except InvalidCursor:
+            return jsonify({'message': '无效的分页游标'}), 400
+        return cursor_page_response([fav.item.to_dict() for fav in favs], next_cursor, page_size)
     
-    favorites = Favorite.query.filter_by(user_id=user_id)\
+    favorites = Favorite.query.options(*favorite_list_options()).filter_by(user_id=user_id)\
         .order_by(Favorite.created_at.desc())\
         .paginate(page=page, per_page=page_size, error_out=False)
     
@@ -2778,30 +5117,68 @@ def get_comments(item_id):
             current_user_id = int(decoded['sub'])
     except:
         pass
-    
+
+    # 评论列表含 is_liked，ETag 需区分当前用户
+    etag = make_etag('comments', item_id, get_generation(comments_generation_name(item_id)), current_user_id)
+    response = conditional_response(etag, lambda: build_comments_payload(item_id, current_user_id))
+    response.vary.add('Authorization')
+    return response
+
+
+def liked_comment_ids(user_id, comment_ids):
+    """一次 IN 查询取出用户在给定评论中点赞过的评论 id 集合"""
+    if not user_id or not comment_ids:
+        return set()
+    rows = db.session.query(CommentLike.comment_id).filter(
+        CommentLike.user_id == user_id, CommentLike.comment_id.in_(comment_ids)
+    ).all()
+    return {row[0] for row in rows}
+
+
+def comment_levels(comments):
+    """根据内存中的评论树计算回复层级：0=顶级评论，1=一级回复，2=二级及更深回复"""
+    parent_of = {comment.id: comment.parent_id for comment in comments}
+    levels = {}
+    for comment in comments:
+        if not comment.parent_id:
+            levels[comment.id] = 0
+        elif comment.parent_id in parent_of:
+            levels[comment.id] = 2 if parent_of[comment.parent_id] else 1
+        # 父评论不在树中（已删除）时不给出层级，由 to_dict 回退查询
+    return levels
+
+
+def build_comments_payload(item_id, current_user_id):
+    # 一次查询取出该物品下所有未删除评论，在内存中按 parent_id 组装成树
+    comments = Comment.query.options(
+        selectinload(Comment.user), selectinload(Comment.reply_to_user)
+    ).filter_by(item_id=item_id, is_deleted=False)\
+        .order_by(Comment.created_at.asc(), Comment.id.asc()).all()
+    children = {}
+    for comment in comments:
+        children.setdefault(comment.parent_id, []).append(comment)
+    levels = comment_levels(comments)
+    liked_ids = liked_comment_ids(current_user_id, [comment.id for comment in comments])
+
     def build_reply_with_children(reply_obj, max_depth=20):
         """递归构建回复及其子回复（level2_replies），支持多层嵌套。"""
-        reply_dict = reply_obj.to_dict(current_user_id)
+        reply_dict = reply_obj.to_dict(current_user_id, children, liked_ids, levels)
         if max_depth <= 0:
             reply_dict['level2_replies'] = []
             return reply_dict
-        children = Comment.query.filter_by(parent_id=reply_obj.id, is_deleted=False)\
-            .order_by(Comment.created_at.asc()).all()
         reply_dict['level2_replies'] = [
-            build_reply_with_children(r, max_depth - 1) for r in children
+            build_reply_with_children(r, max_depth - 1) for r in children.get(reply_obj.id, [])
         ]
         return reply_dict
 
-    # 获取顶级评论（parent_id为None）
-    top_level_comments = Comment.query.filter_by(item_id=item_id, parent_id=None, is_deleted=False)\
-        .order_by(Comment.created_at.desc()).all()
+    # 顶级评论（parent_id为None）按时间倒序
+    top_level_comments = list(reversed(children.get(None, [])))
     
     result = []
     for comment in top_level_comments:
-        comment_dict = comment.to_dict(current_user_id)
-        # 获取该评论的所有一级回复
-        level1_replies = Comment.query.filter_by(parent_id=comment.id, is_deleted=False)\
-            .order_by(Comment.created_at.asc()).all()
+        comment_dict = comment.to_dict(current_user_id, children, liked_ids, levels)
+        # 该评论的所有一级回复
+        level1_replies = children.get(comment.id, [])
         
         # 一级回复及其递归的 level2_replies（支持多层回复链）
         all_replies = [build_reply_with_children(level1_reply) for level1_reply in level1_replies]
@@ -2850,6 +5227,7 @@ def create_comment(item_id):
     )
     
     db.session.add(comment)
+    bump_comments_generation(item_id)
     db.session.commit()
     
     # 刷新对象以获取关联数据
@@ -2896,6 +5274,7 @@ def update_comment(comment_id):
         return jsonify({'message': '评论内容不能为空'}), 400
     
     comment.content = content
+    bump_comments_generation(comment.item_id)
     db.session.commit()
     
     return jsonify(comment.to_dict(user_id))
@@ -2911,6 +5290,7 @@ def delete_comment(comment_id):
         return jsonify({'message': '无权限操作'}), 403
     
     comment.is_deleted = True
+    bump_comments_generation(comment.item_id)
     db.session.commit()
     
     return jsonify({'message': '删除成功'})
@@ -2931,6 +5311,7 @@ def like_comment(comment_id):
     like = CommentLike(comment_id=comment_id, user_id=user_id)
     comment.like_count = (comment.like_count or 0) + 1
     db.session.add(like)
+    bump_comments_generation(comment.item_id)
     db.session.commit()
     
     return jsonify({'message': '点赞成功', 'like_count': comment.like_count}), 201
@@ -2948,6 +5329,7 @@ def unlike_comment(comment_id):
     comment = Comment.query.get_or_404(comment_id)
     comment.like_count = max((comment.like_count or 0) - 1, 0)
     db.session.delete(like)
+    bump_comments_generation(comment.item_id)
     db.session.commit()
     
     return jsonify({'message': '取消点赞成功', 'like_count': comment.like_count})
@@ -3046,7 +5428,7 @@ def get_item_claims(item_id):
     if item.user_id != user_id:
         return jsonify({'message': '无权限查看'}), 403
     
-    claims = Claim.query.filter_by(item_id=item_id)\
+    claims = Claim.query.options(*claim_list_options()).filter_by(item_id=item_id)\
         .order_by(Claim.created_at.desc()).all()
     
     return jsonify([claim.to_dict() for claim in claims])
@@ -3078,6 +5460,7 @@ def approve_claim(claim_id):
         item_id=claim.item_id,
         status='pending'
     ).filter(Claim.id != claim_id).update({'status': 'rejected'})
+    bump_items_generation()
     
     db.session.commit()
     
@@ -3138,7 +5521,7 @@ def get_my_claims():
     user_id = int(get_jwt_identity())
     status = request.args.get('status', '')
     
-    query = Claim.query.filter_by(claimant_id=user_id)
+    query = Claim.query.options(*claim_list_options()).filter_by(claimant_id=user_id)
     if status:
         query = query.filter_by(status=status)
     
@@ -3160,7 +5543,7 @@ def get_pending_claims():
     status = request.args.get('status', '')  # 空字符串表示获取所有状态
     
     # 获取该用户发布的所有物品的认领申请
-    query = Claim.query.join(Item).filter(Item.user_id == user_id)
+    query = Claim.query.options(*claim_list_options()).join(Item).filter(Item.user_id == user_id)
     
     # 如果指定了状态，则筛选
     if status:
@@ -3204,7 +5587,7 @@ def get_user_public_claims(user_id):
     user = User.query.get_or_404(user_id)
     
     # 只返回已批准且公开的认领记录
-    claims = Claim.query.filter_by(
+    claims = Claim.query.options(*claim_list_options()).filter_by(
         claimant_id=user_id,
         status='approved',
         is_public=True
@@ -3227,81 +5610,68 @@ def get_user_public_claims(user_id):
 def get_matched_items(item_id):
     """获取匹配的物品推荐"""
     item = Item.query.get_or_404(item_id)
-    
-    # 匹配逻辑：寻找相反类型的物品（失物匹配拾物，拾物匹配失物）
-    opposite_category = 'found' if item.category == 'lost' else 'lost'
-    
-    # 基础查询：相同类型、相同地点、状态为进行中
-    matches = Item.query.filter(
-        Item.category == opposite_category,
-        Item.status == 'open',
-        Item.id != item_id
+    limit = app.config['MATCH_TOP_N']
+    # 匹配结果由发布/修改后的后台任务写入 item_match，这里只做索引读取；
+    # 尚未计算过的物品（如旧数据、任务还未完成）回退为实时计算
+    computed = ItemMatchState.query.get(item.id) is not None
+    matches = stored_item_matches(item, limit) if computed else find_item_matches(item, limit)
+    return jsonify([match.to_dict() for match in matches])
+
+# ==================== 订阅搜索API ====================
+
+@app.route('/api/saved-searches', methods=['GET'])
+@jwt_required()
+def get_saved_searches():
+    """获取我的订阅搜索"""
+    user_id = int(get_jwt_identity())
+    searches = SavedSearch.query.filter_by(user_id=user_id).order_by(SavedSearch.created_at.desc()).all()
+    return jsonify([s.to_dict() for s in searches])
+
+@app.route('/api/saved-searches', methods=['POST'])
+@jwt_required()
+def create_saved_search():
+    """保存当前搜索条件（search/category/item_type，与 /api/items 参数一致）"""
+    user_id = int(get_jwt_identity())
+    data = request.json or {}
+    search = (data.get('search') or '').strip()[:200]
+    category = (data.get('category') or '').strip()
+    item_type = (data.get('item_type') or '').strip()
+    if category and category not in ('lost', 'found'):
+        return jsonify({'message': '无效的类别'}), 400
+    if not saved_search_terms(search, category, item_type):
+        return jsonify({'message': '请至少填写搜索关键词或选择物品类型'}), 400
+    if SavedSearch.query.filter_by(user_id=user_id).count() >= app.config['SAVED_SEARCH_LIMIT']:
+        return jsonify({'message': f'最多只能保存 {app.config["SAVED_SEARCH_LIMIT"]} 条订阅'}), 400
+    existing = SavedSearch.query.filter_by(
+        user_id=user_id, search=search, category=category, item_type=item_type
+    ).first()
+    if existing:
+        return jsonify({'message': '已订阅该搜索', 'saved_search': existing.to_dict()}), 400
+    saved_search = SavedSearch(
+        user_id=user_id,
+        name=(data.get('name') or '').strip()[:100] or None,
+        search=search,
+        category=category,
+        item_type=item_type
     )
-    
-    # 按类型匹配
-    if item.item_type:
-        type_matches = matches.filter(Item.item_type == item.item_type).all()
-    else:
-        type_matches = []
-    
-    # 按地点匹配（包含相同关键词）
-    location_matches = []
-    if item.location:
-        location_keywords = item.location.split()
-        for keyword in location_keywords:
-            if len(keyword) > 1:  # 忽略单字
-                location_matches.extend(
-                    matches.filter(Item.location.contains(keyword)).all()
-                )
-    
-    # 按描述关键词匹配
-    description_matches = []
-    if item.description:
-        # 提取关键词（简单实现，可以改进）
-        desc_keywords = item.description.split()
-        for keyword in desc_keywords:
-            if len(keyword) > 2:  # 只匹配长度大于2的词
-                description_matches.extend(
-                    matches.filter(
-                        (Item.description.contains(keyword)) |
-                        (Item.title.contains(keyword))
-                    ).all()
-                )
-    
-    # 合并并去重
-    all_matches = {}
-    match_scores = {}
-    
-    # 类型匹配得分最高（3分）
-    for match in type_matches:
-        if match.id not in all_matches:
-            all_matches[match.id] = match
-            match_scores[match.id] = 3
-    
-    # 地点匹配（2分）
-    for match in location_matches:
-        if match.id not in all_matches:
-            all_matches[match.id] = match
-            match_scores[match.id] = 2
-        elif match_scores.get(match.id, 0) < 2:
-            match_scores[match.id] = 2
-    
-    # 描述匹配（1分）
-    for match in description_matches:
-        if match.id not in all_matches:
-            all_matches[match.id] = match
-            match_scores[match.id] = 1
-        elif match_scores.get(match.id, 0) < 1:
-            match_scores[match.id] = 1
-    
-    # 按得分排序，返回前5个
-    sorted_matches = sorted(
-        all_matches.values(),
-        key=lambda x: match_scores.get(x.id, 0),
-        reverse=True
-    )[:5]
-    
-    return jsonify([match.to_dict() for match in sorted_matches])
+    db.session.add(saved_search)
+    db.session.flush()
+    set_saved_search_terms(saved_search)
+    db.session.commit()
+    return jsonify(saved_search.to_dict()), 201
+
+@app.route('/api/saved-searches/<int:saved_search_id>', methods=['DELETE'])
+@jwt_required()
+def delete_saved_search(saved_search_id):
+    """取消订阅"""
+    user_id = int(get_jwt_identity())
+    saved_search = SavedSearch.query.get_or_404(saved_search_id)
+    if saved_search.user_id != user_id:
+        return jsonify({'message': '无权限操作'}), 403
+    SavedSearchTerm.query.filter_by(saved_search_id=saved_search.id).delete(synchronize_session=False)
+    db.session.delete(saved_search)
+    db.session.commit()
+    return jsonify({'message': '已取消订阅'})
 
 @app.route('/api/conversations', methods=['GET'])
 @jwt_required()
@@ -3369,12 +5739,19 @@ def get_messages(conversation_id):
         if msg_dict is not None:
             result.append(msg_dict)
     
-    # 标记所有未读消息为已读
+    # 标记所有未读消息为已读（接收者已删除的消息本就不计入未读数）
+    read_count = Message.query.filter_by(
+        conversation_id=conversation_id,
+        receiver_id=user_id,
+        is_read=False,
+        is_deleted_by_receiver=False
+    ).count()
     Message.query.filter_by(
         conversation_id=conversation_id,
         receiver_id=user_id,
         is_read=False
     ).update({'is_read': True})
+    adjust_unread_counters(user_id, messages=-read_count)
     db.session.commit()
     
     return jsonify(result)
@@ -3388,10 +5765,6 @@ def get_conversation_by_id(conversation_id):
         return jsonify({'message': '无权限访问此会话'}), 403
     return jsonify(conversation.to_dict(user_id))
 
-def send_realtime_notification(user_id, notification_data):
-    """发送实时通知到指定用户"""
-    socketio.emit('new_notification', notification_data, room=f'user_{user_id}')
-
 @app.route('/api/conversations/<int:conversation_id>/messages', methods=['POST'])
 @jwt_required()
 def send_message(conversation_id):
@@ -3437,6 +5810,7 @@ def send_message(conversation_id):
     # 更新会话的最后消息
     conversation.last_message = content[:50] + ('...' if len(content) > 50 else '')
     conversation.last_message_time = datetime.now()
+    adjust_unread_counters(receiver_id, messages=1)
     
     db.session.commit()
     
@@ -3446,7 +5820,9 @@ def send_message(conversation_id):
         receiver_id,
         '新消息',
         f'{sender.username} 给你发送了一条消息',
-        'info'
+        'info',
+        coalesce_key=f'message:{conversation_id}',
+        coalesced_content=f'{sender.username} 给你发送了 {{count}} 条消息'
     )
     
     # 实时推送消息给接收者
@@ -3520,6 +5896,7 @@ def send_image_message(conversation_id):
     # 更新会话的最后消息
     conversation.last_message = '[图片]'
     conversation.last_message_time = datetime.now()
+    adjust_unread_counters(receiver_id, messages=1)
     
     db.session.commit()
     
@@ -3529,7 +5906,9 @@ def send_image_message(conversation_id):
         receiver_id,
         '新消息',
         f'{sender.username} 给你发送了一张图片',
-        'info'
+        'info',
+        coalesce_key=f'message:{conversation_id}',
+        coalesced_content=f'{sender.username} 给你发送了 {{count}} 条消息'
     )
     
     # 实时推送消息给接收者
@@ -3566,6 +5945,8 @@ def delete_message(message_id):
     if message.sender_id == user_id:
         message.is_deleted_by_sender = True
     elif message.receiver_id == user_id:
+        if not message.is_read and not message.is_deleted_by_receiver:
+            adjust_unread_counters(user_id, messages=-1)
         message.is_deleted_by_receiver = True
     else:
         return jsonify({'message': '无权限删除此消息'}), 403
@@ -3594,8 +5975,11 @@ def recall_message(message_id):
     if time_diff.total_seconds() > 120:  # 2分钟
         return jsonify({'message': '超过2分钟无法撤回'}), 400
     
-    # 标记为已撤回
+    # 标记为已撤回（撤回后接收者不再需要阅读）
     message.is_recalled = True
+    if not message.is_read and not message.is_deleted_by_receiver:
+        message.is_read = True
+        adjust_unread_counters(message.receiver_id, messages=-1)
     
     # 删除图片文件
     if message.image_path:
@@ -3613,14 +5997,7 @@ def recall_message(message_id):
 def get_unread_message_count():
     """获取未读消息总数"""
     user_id = int(get_jwt_identity())
-    
-    count = Message.query.filter_by(
-        receiver_id=user_id,
-        is_read=False,
-        is_deleted_by_receiver=False
-    ).count()
-    
-    return jsonify({'count': count})
+    return jsonify({'count': unread_counts(user_id)['messages']})
 
 # 数据导出
 @app.route('/api/export', methods=['GET'])
@@ -3630,7 +6007,7 @@ def export_data():
     category = request.args.get('category', '')
     
     # 查询数据
-    query = Item.query
+    query = Item.query.options(*item_list_options())
     if category:
         query = query.filter_by(category=category)
     
@@ -3711,7 +6088,7 @@ def admin_export_data():
     ws_items = wb.create_sheet("物品")
     ws_items.append(['ID', '标题', '描述', '类型', '物品类型', '地点', '联系人', '联系电话',
                      '日期', '状态', '发布时间', '发布人'])
-    for item in Item.query.order_by(Item.created_at.desc()).all():
+    for item in Item.query.options(*item_list_options()).order_by(Item.created_at.desc()).all():
         ws_items.append([
             item.id,
             item.title,
@@ -3817,6 +6194,8 @@ def handle_connect():
             # 加入用户专属房间
             join_room(f'user_{user_id}')
             print(f'✅ 用户 {user_id} 已连接 WebSocket')
+            # 连接时下发未读数快照，之后依靠 unread_delta 增量更新
+            emit('unread_counts', unread_counts(int(user_id)))
             
             # 可以存储用户在线状态到Redis等
             # r.sadd('online_users', user_id)
@@ -3885,6 +6264,7 @@ def handle_send_message(data):
         conversation = Conversation.query.get(conversation_id)
         conversation.last_message = content[:50]
         conversation.last_message_time = datetime.now()
+        adjust_unread_counters(receiver_id, messages=1)
         
         db.session.commit()
         
@@ -3922,6 +6302,13 @@ if __name__ == '__main__':
         db.create_all()
         print("✅ 数据库表创建成功！")
     
+    interval = app.config['UNREAD_COUNTER_RECONCILE_INTERVAL']
+    if interval > 0:
+        socketio.start_background_task(run_unread_counter_reconciler, interval)
+    interval = app.config['NOTIFICATION_ARCHIVE_INTERVAL']
+    if interval > 0 and app.config['NOTIFICATION_RETENTION_DAYS'] > 0:
+        socketio.start_background_task(run_notification_archiver, interval)
+    
     print("🚀 服务器启动在 http://0.0.0.0:5000")
     socketio.run(app, host='0.0.0.0', debug=False, port=5000)
 
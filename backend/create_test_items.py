@@ -22,7 +22,7 @@ from datetime import datetime, timedelta
 # 添加当前目录到路径
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from app import app, db, User, Item
+from app import app, db, User, Item, index_item_for_search, index_item_for_matching, bump_items_generation
 
 # 测试数据模板
 LOST_ITEMS = [
@@ -261,14 +261,15 @@ def create_items(category, count, user_id):
             contact_name=contact_name,
             contact_phone=contact_phone,
             date=date,
-            image_path=None,  # 不使用图片
-            images_path=None,  # 不使用图片
             status='open',
             user_id=user_id,
             created_at=datetime.now() - timedelta(days=days_ago)
         )
         
         db.session.add(item)
+        db.session.flush()
+        index_item_for_search(item)
+        index_item_for_matching(item)
         created_count += 1
         
         print(f"  ✓ 创建{item_type}：{title} (地点: {location})")
@@ -314,6 +315,7 @@ def main():
         
         # 提交到数据库
         try:
+            bump_items_generation()
             db.session.commit()
             total = (args.lost if args.lost > 0 else 0) + (args.found if args.found > 0 else 0)
             print("\n" + "=" * 60)
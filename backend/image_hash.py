@@ -0,0 +1,157 @@
+"""
+图片感知哈希与近邻索引（匹配推荐、以图搜物共用）。
+
+哈希：64 位 dHash —— 灰度缩放到 9×8，逐行比较相邻像素亮度。对缩放、重新压缩、
+轻微调色不敏感，两张图的相似度用汉明距离衡量。
+
+索引：多索引哈希（Multi-Index Hashing）。把 64 位哈希切成 4 段 16 位，每段一张
+哈希表。两哈希距离 ≤ d 时，按鸽巢原理至少有一段距离 ≤ d // 4，因此查询只需在
+每张表里探测与查询段相差不超过 d // 4 位的取值，再对候选计算完整汉明距离，
+不必与全部图片比较。
+"""
+
+import threading
+from itertools import combinations
+
+from PIL import Image
+
+HASH_BITS = 64
+CHUNK_BITS = 16
+CHUNK_COUNT = HASH_BITS // CHUNK_BITS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+
+def dhash(img):
+    """计算 PIL 图片的 64 位 dHash（整数）"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        # 透明区域按白底处理，避免透明像素的随机底色影响亮度
+        img = img.convert('RGBA')
+        background = Image.new('RGBA', img.size, (255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+    pixels = list(img.convert('L').resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+def hash_to_hex(value):
+    return f'{value:016x}'
+
+
+def hash_from_hex(text):
+    try:
+        return int(text, 16) if text else None
+    except ValueError:
+        return None
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _chunks(value):
+    return [(value >> (i * CHUNK_BITS)) & CHUNK_MASK for i in range(CHUNK_COUNT)]
+
+
+_flip_masks = {}
+
+
+def _masks(radius):
+    """16 位内翻转不超过 radius 位的全部掩码（含 0）"""
+    masks = _flip_masks.get(radius)
+    if masks is None:
+        masks = [0]
+        for r in range(1, radius + 1):
+            for bits in combinations(range(CHUNK_BITS), r):
+                mask = 0
+                for bit in bits:
+                    mask |= 1 << bit
+                masks.append(mask)
+        _flip_masks[radius] = masks
+    return masks
+
+
+class ImageHashIndex:
+    """按物品分组的多索引哈希表。
+
+    每个物品可有多张图片；条目为 image_id -> (item_id, hash)，并记录物品类别供查询过滤。
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self._images = {}        # image_id -> (item_id, hash)
+        self._item_images = {}   # item_id -> [image_id]
+        self._categories = {}    # item_id -> category
+        self._tables = [{} for _ in range(CHUNK_COUNT)]  # 段值 -> set(image_id)
+        self.loaded = False
+        self.synced_generation = None
+        self.synced_at = None
+
+    def __len__(self):
+        return len(self._images)
+
+    def add_item(self, item_id, category, images):
+        """写入/覆盖物品的图片哈希，images 为 [(image_id, hash)]"""
+        with self.lock:
+            self.remove_item(item_id)
+            images = [(image_id, value) for image_id, value in images if value is not None]
+            if not images:
+                return
+            self._categories[item_id] = category
+            self._item_images[item_id] = [image_id for image_id, _ in images]
+            for image_id, value in images:
+                self._images[image_id] = (item_id, value)
+                for table, chunk in zip(self._tables, _chunks(value)):
+                    table.setdefault(chunk, set()).add(image_id)
+
+    def remove_item(self, item_id):
+        with self.lock:
+            self._categories.pop(item_id, None)
+            for image_id in self._item_images.pop(item_id, ()):
+                entry = self._images.pop(image_id, None)
+                if entry is None:
+                    continue
+                for table, chunk in zip(self._tables, _chunks(entry[1])):
+                    ids = table.get(chunk)
+                    if ids is not None:
+                        ids.discard(image_id)
+                        if not ids:
+                            del table[chunk]
+
+    def clear(self):
+        with self.lock:
+            self._images.clear()
+            self._item_images.clear()
+            self._categories.clear()
+            for table in self._tables:
+                table.clear()
+            self.loaded = False
+
+    def search(self, value, max_distance, category=None, exclude_item_id=None):
+        """返回 {item_id: 最小汉明距离}，只包含距离不超过 max_distance 的物品"""
+        radius = min(max_distance // CHUNK_COUNT, CHUNK_BITS)
+        masks = _masks(radius)
+        best = {}
+        with self.lock:
+            seen = set()
+            for table, chunk in zip(self._tables, _chunks(value)):
+                for mask in masks:
+                    ids = table.get(chunk ^ mask)
+                    if not ids:
+                        continue
+                    for image_id in ids:
+                        if image_id in seen:
+                            continue
+                        seen.add(image_id)
+                        item_id, other = self._images[image_id]
+                        if item_id == exclude_item_id:
+                            continue
+                        if category is not None and self._categories.get(item_id) != category:
+                            continue
+                        distance = hamming(value, other)
+                        if distance <= max_distance and distance < best.get(item_id, HASH_BITS + 1):
+                            best[item_id] = distance
+        return best
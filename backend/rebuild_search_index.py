@@ -0,0 +1,33 @@
+"""
+重建物品全文搜索索引（item_fts）与匹配推荐索引（item_token）。
+
+执行方式：
+  python rebuild_search_index.py
+
+适用场景：
+  1. 旧数据库升级后首次启用搜索索引。
+  2. 绕过接口直接改动了 item 表，索引与数据不一致。
+  3. 调整了分词规则后需要重新切分全部物品。
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import app as app_module
+
+
+def main():
+    with app_module.app.app_context():
+        if app_module.SEARCH_FTS_ENABLED:
+            total = app_module.rebuild_item_search_index()
+            print(f"✅ 搜索索引重建完成，共索引 {total} 条物品")
+        else:
+            print("⚠️ 当前 SQLite 不支持 FTS5，搜索将回退为 LIKE 匹配，跳过搜索索引")
+        total = app_module.rebuild_item_match_index()
+        print(f"✅ 匹配索引重建完成，共索引 {total} 条物品")
+
+
+if __name__ == '__main__':
+    main()
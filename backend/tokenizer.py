@@ -0,0 +1,84 @@
+"""
+物品文本分词（搜索、匹配推荐、订阅共用）。
+
+规则：
+  1. CJK 连续段切为相邻二元组，并输出段末单字（保证单字/双字查询可命中）。
+  2. 其余字母数字串整体作为一个词元，统一小写。
+  3. 匹配/订阅使用的词元集合会去掉停用词和单字词元；搜索索引保留完整词元序列，
+     以便 FTS5 短语查询保持相邻关系。
+"""
+
+from functools import lru_cache
+
+# 分词规则或停用词变化时递增，启动时据此判断是否需要重建匹配索引
+TOKENIZER_VERSION = 2
+
+# 停用词：通用虚词 + 失物招领帖子中几乎人人都会写的套话（留着只会制造无意义的匹配）
+STOP_WORDS = frozenset([
+    # 中文二元组
+    '一个', '一下', '一些', '这个', '那个', '这里', '那里', '我们', '你们', '他们', '自己',
+    '什么', '怎么', '没有', '可以', '因为', '所以', '如果', '但是', '还是', '已经', '现在',
+    '时候', '我的', '你的', '请问', '谢谢', '感谢', '麻烦', '的话', '非常', '一定', '左右',
+    '联系', '电话', '微信', '失主', '失物', '拾物', '招领', '寻找', '找到', '捡到', '丢失',
+    '丢了', '遗失', '拾到', '如有', '有人', '看到',
+    # 英文
+    'a', 'an', 'the', 'of', 'in', 'on', 'at', 'to', 'and', 'or', 'is', 'was', 'are', 'be',
+    'it', 'its', 'for', 'with', 'from', 'by', 'my', 'me', 'i', 'you', 'your', 'this', 'that',
+    'lost', 'found', 'please', 'contact', 'thanks',
+])
+
+
+def is_cjk_char(ch):
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF or      # CJK 统一汉字
+        0x3400 <= code <= 0x4DBF or      # 扩展 A
+        0xF900 <= code <= 0xFAFF or      # 兼容汉字
+        0x3040 <= code <= 0x30FF or      # 日文假名
+        0xAC00 <= code <= 0xD7AF or      # 韩文音节
+        0x20000 <= code <= 0x2A6DF       # 扩展 B
+    )
+
+
+def segment_text(text):
+    """切分词元序列：CJK 连续段输出二元组 + 段末单字，其余字母数字串整体输出（小写）"""
+    tokens = []
+    if not text:
+        return tokens
+    cjk_run = []
+    word = []
+
+    def flush_cjk():
+        for i in range(len(cjk_run) - 1):
+            tokens.append(cjk_run[i] + cjk_run[i + 1])
+        if cjk_run:
+            tokens.append(cjk_run[-1])
+        cjk_run.clear()
+
+    def flush_word():
+        if word:
+            tokens.append(''.join(word).lower())
+        word.clear()
+
+    for ch in text:
+        if is_cjk_char(ch):
+            flush_word()
+            cjk_run.append(ch)
+        elif ch.isalnum():
+            flush_cjk()
+            word.append(ch)
+        else:
+            flush_cjk()
+            flush_word()
+    flush_cjk()
+    flush_word()
+    return tokens
+
+
+@lru_cache(maxsize=4096)
+def token_set(text, max_length=50):
+    """匹配/订阅用的词元集合：去掉停用词、单字词元和超长词元"""
+    return frozenset(
+        t for t in segment_text(text)
+        if 1 < len(t) <= max_length and t not in STOP_WORDS
+    )